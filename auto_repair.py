@@ -0,0 +1,133 @@
+import ast
+import html
+import re
+from typing import Dict, List, Optional, Tuple
+
+from code_extractor import extract_code
+from node_index import node_index
+
+HTML_TAG_RE = re.compile(r'</?(pre|code|span|div|p|br)\b[^>]*>', re.I)
+LANGUAGE_ATTR_RE = re.compile(r'^\s*language\s*=\s*["\']?python["\']?\s*>?\s*$', re.I | re.M)
+
+
+def _strip_markup(code: str) -> Tuple[str, List[str]]:
+    """Убирает остатки markdown и HTML вокруг кода"""
+    fixes = []
+    if '```' in code:
+        code = extract_code(code)
+        fixes.append("убраны markdown-ограничители ```")
+    if HTML_TAG_RE.search(code) or LANGUAGE_ATTR_RE.search(code):
+        code = LANGUAGE_ATTR_RE.sub('', HTML_TAG_RE.sub('', code))
+        fixes.append("убраны HTML-теги")
+    if re.search(r'&(gt|lt|amp|quot|#39);', code):
+        code = html.unescape(code)
+        fixes.append("раскодированы HTML-сущности")
+    return code.strip() + "\n", fixes
+
+
+def _offset(lines: List[str], lineno: int, col_offset: int) -> int:
+    """Позиция в строке кода по (lineno, col_offset) из ast; col_offset считается в байтах UTF-8"""
+    line = lines[lineno - 1]
+    column = len(line.encode('utf-8')[:col_offset].decode('utf-8', errors='ignore'))
+    return sum(len(previous) for previous in lines[:lineno - 1]) + column
+
+
+def _resolve_class(module: str, name: str) -> Optional[Tuple[str, str]]:
+    """Находит (модуль, класс), который имелся в виду под module.name"""
+    if node_index.has_class(module, name):
+        return module, name
+    fixed_name = node_index.class_name(module, name)
+    if fixed_name:
+        return module, fixed_name
+    candidates = node_index.find_class(name)
+    if not candidates:
+        return None
+    # Предпочитаем тот же провайдер: diagrams.onprem.* для diagrams.onprem.xxx
+    provider = ".".join(module.split(".")[:2])
+    candidates.sort(key=lambda candidate: not candidate.startswith(provider + "."))
+    target = candidates[0]
+    return target, node_index.class_name(target, name)
+
+
+def _repair_import(node: ast.ImportFrom, fixes: List[str]) -> Optional[str]:
+    """Новый текст импорта или None, если менять нечего (или исправить нельзя)"""
+    by_module: Dict[str, List[str]] = {}
+    changed = False
+    for alias in node.names:
+        local_name = alias.asname or alias.name
+        resolved = _resolve_class(node.module, alias.name) if alias.name != '*' else (node.module, '*')
+        if resolved is None:
+            # Неизвестный класс — оставляем как есть, его исправит LLM
+            resolved = (node.module, alias.name)
+        module, name = resolved
+        if (module, name) != (node.module, alias.name):
+            changed = True
+            fixes.append(f"{node.module}.{alias.name} -> {module}.{name}")
+        # Старое имя сохраняем через as, чтобы не переписывать остальной код
+        by_module.setdefault(module, []).append(name if name == local_name else f"{name} as {local_name}")
+    if not changed:
+        return None
+    indent = " " * node.col_offset
+    return ("\n" + indent).join(f"from {module} import {', '.join(names)}" for module, names in by_module.items())
+
+
+def _repair_diagram_call(call: ast.Call, code: str, lines: List[str], fixes: List[str]) -> Optional[Tuple[int, int, str]]:
+    """Правка (начало, конец, текст), добавляющая show=False в Diagram(...)"""
+    for keyword in call.keywords:
+        if keyword.arg == "show":
+            if isinstance(keyword.value, ast.Constant) and keyword.value.value is False:
+                return None
+            fixes.append(f"строка {call.lineno}: show=False в Diagram(...)")
+            start = _offset(lines, keyword.value.lineno, keyword.value.col_offset)
+            end = _offset(lines, keyword.value.end_lineno, keyword.value.end_col_offset)
+            return start, end, "False"
+    fixes.append(f"строка {call.lineno}: добавлен show=False в Diagram(...)")
+    # Вставляем перед закрывающей скобкой вызова
+    close = _offset(lines, call.end_lineno, call.end_col_offset) - 1
+    before = code[:close].rstrip()
+    if not call.args and not call.keywords:
+        text = "show=False"
+    elif before.endswith(','):
+        text = " show=False"
+    else:
+        text = ", show=False"
+    return close, close, text
+
+
+def repair_code(code: str) -> Tuple[str, List[str]]:
+    """Детерминированно исправляет типичные ошибки кода диаграммы без обращения к LLM.
+
+    Убирает markdown/HTML, исправляет регистр и пространство имён импортируемых
+    классов по индексу узлов, добавляет show=False в Diagram(...). Возвращает
+    (исправленный код, список примененных исправлений).
+    """
+    code, fixes = _strip_markup(code)
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code, fixes
+
+    lines = code.splitlines(keepends=True)
+    edits: List[Tuple[int, int, str]] = []
+    diagram_names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module and node.module.startswith("diagrams"):
+            for alias in node.names:
+                if node.module == "diagrams" and alias.name == "Diagram":
+                    diagram_names.add(alias.asname or alias.name)
+            if node.module != "diagrams" and node_index.available:
+                new_text = _repair_import(node, fixes)
+                if new_text is not None:
+                    start = _offset(lines, node.lineno, node.col_offset)
+                    end = _offset(lines, node.end_lineno, node.end_col_offset)
+                    edits.append((start, end, new_text))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in diagram_names:
+            edit = _repair_diagram_call(node, code, lines, fixes)
+            if edit:
+                edits.append(edit)
+
+    # Применяем правки с конца, чтобы не сдвигать позиции
+    for start, end, text in sorted(edits, reverse=True):
+        code = code[:start] + text + code[end:]
+    return code, fixes
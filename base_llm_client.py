@@ -1,10 +1,95 @@
+import hashlib
+import json
+import logging
+import time
 from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, List, Optional
+
+from config import STREAM_PROGRESS_INTERVAL
+from code_extractor import CodeBlockExtractor, extract_code
+
+logger = logging.getLogger(__name__)
+
+# Колбэк прогресса потоковой генерации: получает весь текст, принятый к этому моменту
+ProgressCallback = Callable[[str], Awaitable[None]]
+
 
 class BaseLLMClient(ABC):
+    # Код провайдера (ключ в llm_client_factories) и его системный промпт
+    provider: str = ""
+    system_prompt: str = ""
+    # Модели, которые показываются, если провайдер не отдает свой список
+    default_models: List[dict] = []
+
+    def get_prompt_version(self) -> str:
+        """Версия промпта: меняется вместе с текстом системного промпта"""
+        return hashlib.sha256(self.system_prompt.encode('utf-8')).hexdigest()[:12]
+
     @abstractmethod
     async def generate_diagram_code(self, user_request: str) -> str:
         raise NotImplementedError
 
     @abstractmethod
     async def fix_code(self, code_with_error: str, error_message: str) -> str:
-        raise NotImplementedError 
\ No newline at end of file
+        raise NotImplementedError
+
+    @staticmethod
+    def _extract_code(content: str) -> str:
+        """Извлекает код из markdown блока ответа модели"""
+        return extract_code(content)
+
+    async def get_available_models(self) -> list:
+        """Список моделей провайдера. По умолчанию — известные модели без запроса к API"""
+        return [dict(model) for model in self.default_models]
+
+    async def generate_diagram_code_stream(self, user_request: str,
+                                           on_progress: Optional[ProgressCallback] = None) -> str:
+        """Потоковая генерация кода. По умолчанию — обычный запрос без прогресса"""
+        return await self.generate_diagram_code(user_request)
+
+    async def generate_diagram_candidates(self, user_request: str, count: int) -> List[str]:
+        """Несколько вариантов кода для спекулятивного рендера. По умолчанию — один вариант"""
+        return [await self.generate_diagram_code(user_request)]
+
+    def _unique_candidates(self, result: dict) -> List[str]:
+        """Код из всех choices ответа chat/completions без повторов, в исходном порядке"""
+        candidates = []
+        for choice in result.get('choices') or []:
+            code = self._extract_code(choice['message']['content'])
+            if code and code not in candidates:
+                candidates.append(code)
+        return candidates
+
+    async def _read_stream(self, response, on_progress: Optional[ProgressCallback] = None) -> str:
+        """Собирает текст из SSE-ответа chat/completions (формат OpenAI).
+
+        Чтение прекращается, как только закрыт первый блок кода с импортом diagrams:
+        остаток ответа нам не нужен, а закрытое соединение останавливает генерацию
+        на сервере. on_progress вызывается не чаще, чем раз в STREAM_PROGRESS_INTERVAL секунд.
+        """
+        extractor = CodeBlockExtractor()
+        last_progress = time.monotonic()
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8', errors='ignore').strip()
+            if not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            try:
+                event = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            for choice in event.get('choices', []):
+                extractor.feed((choice.get('delta') or {}).get('content') or '')
+            if extractor.ready:
+                response.close()
+                break
+            if on_progress and time.monotonic() - last_progress >= STREAM_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                try:
+                    await on_progress(extractor.text)
+                except Exception as e:
+                    # Прогресс — только косметика: ошибка показа (RetryAfter, сеть) не прерывает генерацию
+                    logger.warning(f"Не удалось показать прогресс генерации: {e}")
+        return extractor.text
@@ -0,0 +1,114 @@
+import re
+from typing import List, Optional, Tuple
+
+# Метки языка, которые считаем Python (пустая — блок без метки)
+PYTHON_LANGS = ("python", "py", "python3", "py3", "")
+
+FENCE = "```"
+DIAGRAMS_IMPORT_RE = re.compile(r'^\s*(from\s+diagrams[\s.]|import\s+diagrams\b)', re.M)
+
+
+def imports_diagrams(code: str) -> bool:
+    return DIAGRAMS_IMPORT_RE.search(code) is not None
+
+
+class CodeBlockExtractor:
+    """Инкрементально выделяет markdown-блоки кода из ответа модели.
+
+    Принимает текст кусками (feed) или целиком (extract_code). Понимает
+    ```python/```py/```python3 и блоки без метки, несколько блоков подряд.
+    feed() возвращает True, как только закрыт первый Python-блок с импортом
+    diagrams — после этого запрос к модели можно прерывать.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.blocks: List[Tuple[str, str]] = []  # (метка языка, код)
+        self._pending = ""
+        self._lang: Optional[str] = None  # не None — сейчас внутри блока
+        self._lines: List[str] = []
+        self.ready = False
+
+    def feed(self, chunk: str) -> bool:
+        self.text += chunk
+        self._pending += chunk
+        *lines, self._pending = self._pending.split('\n')
+        for line in lines:
+            self._feed_line(line)
+        if self._lang is not None and self._pending.strip() == FENCE:
+            # Закрывающая ``` пришла без перевода строки — не ждем следующего куска
+            self._feed_line(self._pending)
+            self._pending = ""
+        return self.ready
+
+    def finish(self) -> bool:
+        """Дообрабатывает хвост ответа; незакрытый в конце блок тоже считается блоком"""
+        if self._pending:
+            self._feed_line(self._pending)
+            self._pending = ""
+        if self._lang is not None:
+            self._close_block()
+        return self.ready
+
+    def _feed_line(self, line: str):
+        if self._lang is None:
+            start = line.find(FENCE)
+            if start == -1:
+                return
+            rest = line[start + len(FENCE):]
+            end = rest.find(FENCE)
+            if end != -1:
+                # Однострочный блок: ```код``` или ```python код```
+                self._lang, body = self._split_inline_lang(rest[:end])
+                self._lines = [body]
+                self._close_block()
+                return
+            info = rest.strip().split()
+            self._lang = info[0].lower() if info else ""
+            self._lines = []
+            return
+        end = line.find(FENCE)
+        if end == -1:
+            self._lines.append(line)
+            return
+        if line[:end].strip():
+            # Закрывающая ``` в конце строки кода
+            self._lines.append(line[:end])
+        self._close_block()
+
+    @staticmethod
+    def _split_inline_lang(body: str) -> Tuple[str, str]:
+        """(метка языка, код) однострочного блока. Признаем только метки Python:
+        в ```import diagrams``` первое слово — уже код"""
+        parts = body.strip().split(None, 1)
+        if len(parts) == 2 and parts[0].lower() in PYTHON_LANGS:
+            return parts[0].lower(), parts[1]
+        return "", body
+
+    def _close_block(self):
+        code = "\n".join(self._lines).strip()
+        self.blocks.append((self._lang, code))
+        if self._lang in PYTHON_LANGS and imports_diagrams(code):
+            self.ready = True
+        self._lang = None
+        self._lines = []
+
+    def best(self) -> str:
+        """Лучший блок: Python с импортом diagrams, затем любой Python, затем первый; без блоков — весь текст"""
+        python_blocks = [code for lang, code in self.blocks if lang in PYTHON_LANGS and code]
+        for code in python_blocks:
+            if imports_diagrams(code):
+                return code
+        if python_blocks:
+            return python_blocks[0]
+        if self.blocks:
+            return self.blocks[0][1]
+        return self.text.strip()
+
+
+def extract_code(content: str) -> str:
+    """Извлекает код диаграммы из полного ответа модели"""
+    extractor = CodeBlockExtractor()
+    extractor.feed(content)
+    extractor.finish()
+    return extractor.best()
@@ -0,0 +1,195 @@
+import ast
+import builtins
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Set
+
+from config import MAX_CODE_LENGTH, CODE_VALIDATION_CACHE_SIZE
+from node_index import node_index, DIAGRAMS_CORE_CLASSES
+
+# Встроенные функции, которых достаточно для описания диаграммы
+SAFE_BUILTINS = frozenset({
+    "abs", "all", "any", "bool", "dict", "enumerate", "float", "int", "isinstance", "len", "list",
+    "max", "min", "print", "range", "reversed", "round", "set", "sorted", "str", "sum", "tuple", "zip",
+    "True", "False", "None",
+})
+BUILTIN_NAMES = frozenset(dir(builtins))
+# Атрибуты, через которые код добирается до объектов Python или пишет файлы:
+# str.format("{0.__init__.__globals__}") обходит проверку атрибутов в строке,
+# Diagram.dot — объект graphviz с save/render/pipe/view в произвольный путь
+FORBIDDEN_ATTRIBUTES = frozenset({"format", "format_map", "dot", "save", "render", "pipe", "view"})
+# Атрибуты кадров, генераторов, корутин, трассировок и кода (gi_frame.f_globals и т.п.)
+INTERNAL_ATTRIBUTE_PREFIXES = ("gi_", "cr_", "ag_", "f_", "tb_", "co_")
+
+
+class _AllowlistVisitor(ast.NodeVisitor):
+    """Проходит дерево один раз и собирает все нарушения"""
+
+    def __init__(self):
+        self.reasons: List[str] = []
+        self.imports_diagrams = False
+        # Локальные имена, под которыми доступны модули diagrams: имя -> полное имя модуля
+        self.modules: Dict[str, str] = {}
+        # Локальные имена класса diagrams.Diagram
+        self.diagram_names: Set[str] = set()
+
+    def _reject(self, node: ast.AST, reason: str):
+        self.reasons.append(f"строка {getattr(node, 'lineno', '?')}: {reason}")
+
+    @staticmethod
+    def _is_diagrams_module(module: str) -> bool:
+        return module == "diagrams" or module.startswith("diagrams.")
+
+    def collect_modules(self, tree: ast.AST):
+        """Запоминает имена модулей заранее: обращение к модулю может стоять выше импорта (в функции)"""
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if not self._is_diagrams_module(alias.name):
+                        continue
+                    if alias.asname:
+                        self.modules[alias.asname] = alias.name
+                    else:
+                        self.modules[alias.name.split(".")[0]] = alias.name.split(".")[0]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and self._is_diagrams_module(node.module or ""):
+                for alias in node.names:
+                    path = f"{node.module}.{alias.name}"
+                    if node_index.has_module(path):
+                        self.modules[alias.asname or alias.name] = path
+                    elif path == "diagrams.Diagram":
+                        self.diagram_names.add(alias.asname or alias.name)
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            if not self._is_diagrams_module(alias.name):
+                self._reject(node, f"импорт модуля {alias.name} запрещен, разрешены только diagrams.*")
+            elif not node_index.has_module(alias.name):
+                self._reject(node, f"модуля {alias.name} нет в diagrams")
+            else:
+                self.imports_diagrams = True
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        module = node.module or ""
+        if node.level != 0 or not self._is_diagrams_module(module):
+            self._reject(node, f"импорт из {'.' * node.level}{module} запрещен, разрешены только diagrams.*")
+            return
+        self.imports_diagrams = True
+        for alias in node.names:
+            if alias.name == "*":
+                self._reject(node, f"импорт * из {module} запрещен, импортируйте классы по имени")
+            elif node_index.resolve(f"{module}.{alias.name}") is None:
+                if module == "diagrams":
+                    allowed = ", ".join(sorted(DIAGRAMS_CORE_CLASSES))
+                    self._reject(node, f"из diagrams можно импортировать только {allowed}, а не {alias.name}")
+                else:
+                    self._reject(node, f"импорт {alias.name} из {module} запрещен: это не класс узла diagrams")
+
+    def visit_Name(self, node: ast.Name):
+        if node.id.startswith("__"):
+            self._reject(node, f"служебное имя {node.id} запрещено")
+        elif isinstance(node.ctx, ast.Load) and node.id in self.modules:
+            self._reject(node, f"модуль {node.id} можно использовать только для обращения к классам ({node.id}.Класс)")
+        elif isinstance(node.ctx, ast.Load) and node.id in BUILTIN_NAMES and node.id not in SAFE_BUILTINS:
+            self._reject(node, f"встроенная функция {node.id} запрещена")
+
+    def _check_attribute(self, node: ast.Attribute):
+        if node.attr.startswith("_"):
+            self._reject(node, f"обращение к служебному или закрытому атрибуту {node.attr} запрещено")
+        elif node.attr in FORBIDDEN_ATTRIBUTES or node.attr.startswith(INTERNAL_ATTRIBUTE_PREFIXES):
+            self._reject(node, f"обращение к атрибуту {node.attr} запрещено")
+
+    def visit_Attribute(self, node: ast.Attribute):
+        # Цепочку a.b.c разбираем целиком: обращения через модули diagrams проверяются по индексу
+        attrs = []
+        base = node
+        while isinstance(base, ast.Attribute):
+            self._check_attribute(base)
+            attrs.append(base.attr)
+            base = base.value
+        if isinstance(base, ast.Name) and base.id in self.modules:
+            invalid = node_index.invalid_attribute(self.modules[base.id], reversed(attrs))
+            if invalid:
+                self._reject(node, f"обращение к {invalid} запрещено: это не класс узла или модуль diagrams")
+        else:
+            self.visit(base)
+
+    def _is_diagram_class(self, func: ast.AST) -> bool:
+        if isinstance(func, ast.Name):
+            return func.id in self.diagram_names
+        return isinstance(func, ast.Attribute) and func.attr == "Diagram"
+
+    def visit_Call(self, node: ast.Call):
+        if self._is_diagram_class(node.func):
+            # Diagram(name, filename, ...): изображение сохраняется по filename, он должен остаться в каталоге рендера
+            filename = node.args[1] if len(node.args) > 1 else None
+            for keyword in node.keywords:
+                if keyword.arg == "filename":
+                    filename = keyword.value
+            if filename is not None and not (
+                isinstance(filename, ast.Constant) and isinstance(filename.value, str)
+                and not any(char in filename.value for char in "/\\") and not filename.value.startswith(".")
+            ):
+                self._reject(node, "filename у Diagram должен быть простым именем файла без пути")
+        self.generic_visit(node)
+
+
+class CodeValidator:
+    """Проверка кода диаграммы по белому списку на дереве разбора.
+
+    Разрешены только импорты diagrams.* и безопасные встроенные функции.
+    Из diagrams берутся только классы узлов и модули из индекса узлов (из
+    самого пакета — Diagram, Cluster, Edge, Node, Group), обращения через
+    модули тоже сверяются с индексом. Запрещены служебные имена (__import__),
+    атрибуты, начинающиеся с "_", атрибуты кадров и генераторов (gi_frame,
+    f_globals), str.format и format_map, объект graphviz Diagram.dot с его
+    save/render/pipe/view, а также filename у Diagram с путем.
+    Это уменьшает поверхность атаки, но не заменяет изоляцию: код все равно
+    выполняется в отдельном процессе с лимитами и без секретов в окружении.
+    Строки не проверяются, поэтому подписи вроде "open(" не мешают.
+    Результат кэшируется по хэшу кода: при повторных попытках один и тот же
+    код не разбирается заново.
+    """
+
+    def __init__(self, cache_size: int = CODE_VALIDATION_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, List[str]]" = OrderedDict()
+
+    def validate(self, code: str) -> List[str]:
+        """Список причин, по которым код нельзя запускать (пустой — код допустим)"""
+        key = hashlib.sha256(code.encode('utf-8')).hexdigest()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return list(self._cache[key])
+        reasons = self._validate(code)
+        self._cache[key] = reasons
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return list(reasons)
+
+    @staticmethod
+    def _validate(code: str) -> List[str]:
+        if len(code) > MAX_CODE_LENGTH:
+            return [f"код длиннее {MAX_CODE_LENGTH} символов"]
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            return [f"строка {e.lineno}: синтаксическая ошибка: {e.msg}"]
+        except ValueError as e:
+            return [f"код не разбирается: {e}"]
+        if not node_index.available:
+            return ["индекс узлов diagrams недоступен, проверить импорты нельзя"]
+        visitor = _AllowlistVisitor()
+        visitor.collect_modules(tree)
+        visitor.visit(tree)
+        if not visitor.imports_diagrams:
+            visitor.reasons.append("нет импорта diagrams")
+        return visitor.reasons
+
+
+def format_reasons(reasons: List[str]) -> str:
+    """Текст ошибки для пользователя и для fix_code"""
+    return "Небезопасный или некорректный код:\n" + "\n".join(f"- {reason}" for reason in reasons)
+
+
+# Глобальный валидатор кода диаграмм
+code_validator = CodeValidator()
@@ -6,6 +6,18 @@ load_dotenv()
 # Telegram Bot Token
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 PROXYAPI_KEY = os.getenv('PROXYAPI_KEY')
+# Другой сервер Bot API вместо api.telegram.org (например, fake_telegram.py для локальной проверки)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+
+# Получение обновлений: "polling" (long polling) или "webhook" (aiohttp-сервер;
+# несколько процессов бота можно поставить за балансировщиком)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный https-адрес для setWebhook (не задан — вебхук не регистрируется)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # проверяется в заголовке X-Telegram-Bot-Api-Secret-Token, обязателен для вебхука
+WEBHOOK_DRAIN_TIMEOUT = 120  # секунд на завершение начатых генераций при остановке
 
 # GigaChat API Configuration
 GIGACHAT_BASE_URL = "https://gigachat.devices.sberbank.ru/api/v1"
@@ -14,11 +26,104 @@ GIGACHAT_AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
 # File paths
 TEMP_DIR = "temp"
 DIAGRAMS_DIR = "diagrams"
+USER_DB_FILE = "user_data.sqlite3"  # настройки пользователей
+USER_DATA_JSON_FILE = "user_data.json"  # старый формат, переносится в USER_DB_FILE
+USER_SETTINGS_TTL = 5.0  # секунд, сколько процесс помнит прочитанные настройки пользователя
+NODE_INDEX_FILE = "diagrams_index.json"  # индекс модулей и классов установленной diagrams
+
+# Состояния диалогов (FSM): "sqlite" — в файле FSM_DB_FILE, переживают перезапуск и общие
+# для нескольких процессов бота; "memory" — только в памяти процесса
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_DB_FILE = os.getenv('FSM_DB_FILE', 'fsm.sqlite3')
+FSM_STATE_TTL = 24 * 3600  # секунд без изменений, после которых состояние сбрасывается (0 — не сбрасывать)
+FSM_FLUSH_INTERVAL = 0.5  # секунд: изменения состояний записываются пачкой
 
 # Limits
 MAX_CODE_LENGTH = 5000
+# Сколько результатов проверки кода помнить (по хэшу кода)
+CODE_VALIDATION_CACHE_SIZE = 256
 MAX_DIAGRAM_SIZE = 2048
 
+# Форматы, которые diagrams может создать и Telegram может показать как фото
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Рендеринг диаграмм
+# Таймаут рендера растет с числом узлов и связей: BASE + узлы * PER_NODE + связи * PER_EDGE, не больше MAX
+RENDER_TIMEOUT_BASE = 20  # секунд
+RENDER_TIMEOUT_PER_NODE = 0.5
+RENDER_TIMEOUT_PER_EDGE = 0.25
+RENDER_TIMEOUT_MAX = 120
+# Движок рендера: "python" — выполнять сгенерированный скрипт; "dot" — только статический
+# разбор кода в DOT и один вызов Graphviz (без выполнения кода); "auto" — dot, а если
+# код не укладывается в поддерживаемое подмножество, выполнение скрипта
+RENDER_ENGINE = "auto"
+DOT_BINARY = "dot"
+# Лимиты процесса рендера (вместе с Graphviz): память и открытые файлы; CPU — по таймауту
+RENDER_MEMORY_LIMIT = 1024 * 1024 * 1024  # байт адресного пространства (0 — без ограничения)
+RENDER_MAX_OPEN_FILES = 256
+# Переменные окружения, которые видит процесс рендера; остальные (BOT_TOKEN, ключи API) не передаются
+RENDER_ENV_VARS = ("PATH", "PYTHONPATH", "HOME", "LANG", "LC_ALL", "LC_CTYPE", "TMPDIR", "TEMP", "TMP",
+                   "SYSTEMROOT", "FONTCONFIG_PATH", "FONTCONFIG_FILE", "GVBINDIR")
+RENDER_POOL_SIZE = 2  # прогретых воркеров (0 — запускать отдельный процесс на каждый рендер)
+RENDER_WORKER_MAX_JOBS = 50  # после стольких заданий воркер пересоздается
+RENDER_WORKER_START_TIMEOUT = 60  # секунд на запуск воркера и импорт diagrams
+RENDER_MAX_CONCURRENT = 4  # одновременных генераций (запрос к LLM + рендер)
+RENDER_MAX_QUEUE = 50  # ожидающих генераций, сверх этого запросы отклоняются
+# Спекулятивная генерация: запросить у модели столько вариантов кода сразу, рендерить их
+# параллельно и взять первый успешный (1 — выключено; расходует больше токенов)
+SPECULATIVE_CANDIDATES = 1
+SPECULATIVE_TEMPERATURE = 0.7  # при низкой температуре варианты почти не отличаются
+
+# Очередь заданий на генерацию: "" — генерировать прямо в процессе бота; "memory" — через
+# очередь в памяти и воркеры в том же процессе; "sqlite" — через файл очереди, задания
+# выполняют отдельные процессы `python job_worker.py` (в том числе несколько)
+JOB_QUEUE = os.getenv('JOB_QUEUE', '')
+JOB_QUEUE_FILE = os.getenv('JOB_QUEUE_FILE', 'jobs.sqlite3')
+JOB_WORKER_CONCURRENCY = 4  # одновременных заданий на один воркер
+JOB_RESULT_TIMEOUT = 600  # секунд ожидания результата ботом
+JOB_LEASE_TIMEOUT = 900  # задание, взятое упавшим воркером, возвращается в очередь через столько секунд
+JOB_POLL_INTERVAL = 0.5  # секунд между опросами файла очереди
+
+# Кэш готовых изображений по хэшу нормализованного кода (0 — отключить)
+RENDER_CACHE_MAX_BYTES = 200 * 1024 * 1024
+RENDER_CACHE_MAX_AGE = 7 * 24 * 3600  # секунд с последнего использования
+RENDER_CACHE_PIN_TIME = 300  # секунд после выдачи, пока файл не вытесняется (его отправляют пользователю)
+
+# Кэш кода, сгенерированного LLM, по (провайдер, модель, запрос, версия промпта)
+LLM_CACHE_FILE = "llm_cache.sqlite3"
+LLM_CACHE_TTL = 24 * 3600  # секунд (0 — отключить)
+
+# file_id уже отправленных в Telegram изображений (повторная отправка без загрузки)
+TELEGRAM_FILE_CACHE_FILE = "telegram_files.sqlite3"
+
+# Потоковая генерация кода (SSE) с показом прогресса
+LLM_STREAMING = True
+STREAM_PROGRESS_INTERVAL = 2.0  # секунд между обновлениями статуса (ограничение Telegram на edit)
+
+# Системный промпт GigaChat: "compact" — только разделы каталога, относящиеся к запросу,
+# "full" — весь GIGACHAT_SYSTEM_PROMPT (для сравнения качества)
+PROMPT_MODE = "compact"
+PROMPT_MAX_CHARS = 14000
+GIGACHAT_PROMPT_CACHE = True  # кэширование контекста GigaChat (заголовок X-Session-ID)
+
+# Кэш списков моделей провайдеров (меню выбора модели)
+MODEL_CATALOG_FILE = "models_cache.json"  # последний удачный список, доступен сразу после перезапуска
+MODEL_CATALOG_TTL = 3600  # секунд; более старый список отдается сразу, но обновляется в фоне
+MODEL_CATALOG_REFRESH_INTERVAL = 6 * 3600  # секунд между плановыми обновлениями (0 — не обновлять)
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (порт 0 — отключить).
+# Каждому процессу (бот, воркеры очереди) нужен свой порт
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# OAuth token cache: обновлять токен за столько секунд до истечения
+TOKEN_REFRESH_MARGIN = 60
+
+# HTTP-соединения к LLM-провайдерам (общая сессия на провайдера)
+HTTP_LIMIT_PER_HOST = 20
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_DNS_CACHE_TTL = 300
+
 # GigaChat system prompt for diagram generation
 GIGACHAT_SYSTEM_PROMPT = """
 ВНИМАНИЕ: Ты можешь использовать ТОЛЬКО те классы и пространства имён diagrams, которые перечислены в списке ниже. НЕЛЬЗЯ придумывать свои классы, пространства имён или иконки. Если подходящего класса нет — выбери наиболее близкий из списка, но не выдумывай новый.
@@ -2,11 +2,32 @@ import os
 import sys
 import subprocess
 import asyncio
+import logging
+import shutil
+import signal
+import tempfile
+import time
+import uuid
 from pathlib import Path
-from typing import Optional
-from config import TEMP_DIR, DIAGRAMS_DIR, MAX_CODE_LENGTH
+from typing import List, Optional, Tuple
+from config import TEMP_DIR, DIAGRAMS_DIR, RENDER_ENGINE, DOT_BINARY
+from render_pool import render_pool
+from render_cache import render_cache
+from code_validator import code_validator, format_reasons
+from preflight import preflight_check, format_problems
+from auto_repair import repair_code
+from render_worker import CODE_FILE_NAME, find_output_image
+from render_limits import render_timeout, apply_render_limits, render_environment, resource
+from dot_engine import build_dot, UnsupportedCode
+from llm_clients import clone_llm_client
+from metrics import (
+    track_llm, count_cache, render_duration, diagram_attempts, diagram_failures,
+    render_subprocesses, render_subprocesses_started,
+)
 
 
+logger = logging.getLogger(__name__)
+
 class DiagramGenerator:
     def __init__(self):
         self.temp_dir = Path(TEMP_DIR)
@@ -14,99 +35,142 @@ class DiagramGenerator:
         self.temp_dir.mkdir(exist_ok=True)
         self.diagrams_dir.mkdir(exist_ok=True)
     
-    def _validate_code(self, code: str) -> bool:
-        """Проверяет безопасность кода"""
-        if len(code) > MAX_CODE_LENGTH:
-            return False
-            
-        # Запрещенные импорты и функции
-        forbidden_patterns = [
-            'import sys', 
-            'import subprocess',
-            'import shutil',
-            'import glob',
-            'from sys',
-            'from subprocess',
-            'from shutil',
-            'from glob',
-            '__import__',
-            'eval(',
-            'exec(',
-            'open(',
-            'file(',
-            'input(',
-            'raw_input(',
-            'compile(',
-            'reload(',
-            'vars(',
-            'dir(',
-            'getattr(',
-            'setattr(',
-            'delattr(',
-            'hasattr(',
-        ]
-        
-        code_lower = code.lower()
-        for pattern in forbidden_patterns:
-            if pattern in code_lower:
-                return False
-                
-        # Должен содержать импорт diagrams
-        if 'from diagrams' not in code and 'import diagrams' not in code:
-            return False
-            
-        return True
+    async def _run_limited(self, args: List[str], work_dir: Path, timeout: float, input_data: Optional[bytes] = None,
+                           env: Optional[dict] = None) -> bytes:
+        """Запускает процесс рендера с лимитами ресурсов; возвращает stdout или поднимает RuntimeError со stderr"""
+        extra = {}
+        if resource is not None:
+            # Своя группа процессов (чтобы убить и dot) и лимиты ресурсов
+            extra = {'start_new_session': True, 'preexec_fn': lambda: apply_render_limits(timeout)}
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=str(work_dir),
+            env=env,
+            stdin=asyncio.subprocess.PIPE if input_data is not None else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **extra
+        )
+        render_subprocesses_started.inc(kind="dot" if args[0] == DOT_BINARY else "python")
+        render_subprocesses.inc()
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(input_data), timeout=timeout)
+        except BaseException:
+            # Таймаут или отмена (например, проигравший спекулятивный кандидат): процесс больше не нужен
+            if process.returncode is None:
+                self._kill_process_group(process)
+                await process.wait()
+            raise
+        finally:
+            render_subprocesses.dec()
+        if process.returncode != 0:
+            raise RuntimeError(stderr.decode('utf-8', errors='ignore'))
+        return stdout
+    
+    async def _render_in_subprocess(self, work_dir: Path, timeout: float) -> Tuple[Optional[bytes], Optional[str]]:
+        """Запускает скрипт отдельным процессом Python (если пул воркеров недоступен)"""
+        env = render_environment(PYTHONPATH=str(work_dir))
+        await self._run_limited([sys.executable, CODE_FILE_NAME], work_dir, timeout, env=env)
+        # Ищем созданное изображение, имя файла зависит от названия диаграммы
+        image_file = find_output_image(work_dir)
+        if image_file is None:
+            return None, None
+        return image_file.read_bytes(), image_file.suffix.lower()
+    
+    async def _render_dot(self, source: str, outformat: str, work_dir: Path,
+                          timeout: float) -> Tuple[Optional[bytes], Optional[str]]:
+        """Рендерит готовое DOT-описание одним вызовом Graphviz, без Python-процесса"""
+        image_bytes = await self._run_limited(
+            [DOT_BINARY, f"-T{outformat}"], work_dir, timeout, input_data=source.encode('utf-8'),
+            env=render_environment()
+        )
+        return image_bytes or None, f".{outformat}" if image_bytes else None
+    
+    @staticmethod
+    def _kill_process_group(process):
+        """Убивает процесс рендера вместе с запущенными им процессами Graphviz"""
+        try:
+            if resource is not None:
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+    
+    async def _render(self, code: str, work_dir: Path, timeout: float) -> Tuple[Optional[bytes], Optional[str]]:
+        if RENDER_ENGINE != "python" and (RENDER_ENGINE == "dot" or shutil.which(DOT_BINARY)):
+            try:
+                source, outformat = build_dot(code)
+            except UnsupportedCode as e:
+                if RENDER_ENGINE == "dot":
+                    raise RuntimeError(f"Код не удалось построить без выполнения: {e}")
+                logger.info(f"Рендер без выполнения кода невозможен ({e}), выполняю скрипт")
+            else:
+                with render_duration.time(engine="dot"):
+                    return await self._render_dot(source, outformat, work_dir, timeout)
+        if render_pool.enabled:
+            await render_pool.start()
+            if render_pool.enabled:
+                with render_duration.time(engine="pool"):
+                    return await render_pool.render(code, work_dir, timeout)
+        with render_duration.time(engine="subprocess"):
+            return await self._render_in_subprocess(work_dir, timeout)
+    
+    def store_image(self, code: str, image_bytes: bytes, suffix: str, user_id: int) -> str:
+        """Сохраняет готовое изображение в кэш или, если он отключен, в diagrams/; возвращает путь"""
+        if render_cache.enabled:
+            output_file = render_cache.put(code, image_bytes, suffix)
+        else:
+            output_file = self.diagrams_dir / f"diagram_{user_id}_{int(time.time())}_{uuid.uuid4().hex[:8]}{suffix}"
+            output_file.write_bytes(image_bytes)
+        return str(output_file.resolve())
     
     async def generate_diagram(self, code: str, user_id: int) -> Optional[str]:
         """Генерирует диаграмму из кода и возвращает путь к файлу"""
-        if not self._validate_code(code):
-            raise ValueError("Небезопасный или некорректный код")
+        reasons = code_validator.validate(code)
+        if reasons:
+            diagram_failures.inc(reason="validation")
+            raise ValueError(format_reasons(reasons))
+        
+        # Такой же код уже рендерили — отдаем готовое изображение без запуска процесса
+        cached_file = render_cache.get(code)
+        if render_cache.enabled:
+            count_cache("render", cached_file is not None)
+        if cached_file is not None:
+            logger.debug(f"Изображение взято из кэша: {cached_file.resolve()}")
+            return str(cached_file)
         
-        import time
         timestamp = int(time.time())
-        code_file = self.temp_dir / f"diagram_code_{user_id}_{timestamp}.py"
-        png_file = self.temp_dir / f"output.png"
-        print(f"[DEBUG] code_file: {code_file.resolve()}")
-        print(f"[DEBUG] png_file (ожидаемый PNG): {png_file.resolve()}")
-        print(f"[DEBUG] diagrams_dir (куда копируем): {self.diagrams_dir.resolve()}")
-        print(f"[DEBUG] cwd процесса: {self.temp_dir.resolve()}")
+        # У каждого запуска своя рабочая директория: параллельные генерации
+        # не видят чужих и устаревших картинок
+        work_dir = Path(tempfile.mkdtemp(prefix=f"render_{user_id}_{timestamp}_", dir=self.temp_dir))
+        code_file = work_dir / CODE_FILE_NAME
+        timeout = render_timeout(code)
+        logger.debug(f"Рендер {code_file.resolve()}, результат в {self.diagrams_dir.resolve()}")
         try:
             with open(code_file, 'w', encoding='utf-8') as f:
                 f.write(code)
-            env = os.environ.copy()
-            env['PYTHONPATH'] = str(self.temp_dir)
-            process = await asyncio.create_subprocess_exec(
-                sys.executable, code_file.name,
-                cwd=str(self.temp_dir),
-                env=env,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=30)
-            if process.returncode != 0:
-                error_msg = stderr.decode('utf-8', errors='ignore')
-                print(f"[DEBUG] diagrams process stderr: {error_msg}")
+            try:
+                image_bytes, suffix = await self._render(code, work_dir, timeout)
+            except RuntimeError as e:
+                diagram_failures.inc(reason="render_error")
+                error_msg = str(e)
+                logger.debug(f"Ошибка процесса рендера: {error_msg}")
                 raise Exception(f"Ошибка выполнения кода:\n{error_msg}")
-            # Проверяем, что PNG создан
-            if not png_file.exists():
-                print(f"[DEBUG] PNG не найден по пути: {png_file.resolve()}")
+            if image_bytes is None:
+                diagram_failures.inc(reason="no_image")
+                logger.debug(f"Изображение не найдено в {work_dir.resolve()}")
                 raise Exception("Диаграмма не была создана. Проверьте код.")
-            # Копируем PNG в diagrams/
-            output_file = self.diagrams_dir / f"diagram_{user_id}_{timestamp}.png"
-            import shutil
-            shutil.copy2(png_file, output_file)
-            print(f"[DEBUG] PNG успешно скопирован в: {output_file.resolve()}")
-            return str(output_file)
+            output_file = self.store_image(code, image_bytes, suffix, user_id)
+            logger.debug(f"Изображение сохранено в {output_file}")
+            return output_file
         except asyncio.TimeoutError:
-            raise Exception("Превышено время выполнения кода (30 секунд)")
+            diagram_failures.inc(reason="timeout")
+            raise Exception(f"Превышено время выполнения кода ({timeout:.0f} секунд)")
         except Exception as e:
             raise Exception(f"Ошибка генерации диаграммы: {str(e)}")
         finally:
-            try:
-                if Path(code_file).exists():
-                    Path(code_file).unlink()
-            except:
-                pass
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 
 # Глобальный экземпляр генератора
@@ -115,21 +179,64 @@ diagram_generator = DiagramGenerator()
 async def generate_diagram_with_retries(code: str, user_id: int, llm_client, max_attempts: int = 3):
     """
     Пытается сгенерировать диаграмму до max_attempts раз, отправляя ошибку и код в llm_client.fix_code при неудаче.
-    Возвращает путь к диаграмме или (None, последний_код, последняя_ошибка) если не удалось.
+    Возвращает (путь_к_диаграмме, рабочий_код, None) или (None, последний_код, последняя_ошибка) если не удалось.
     """
     last_error = None
     last_code = code
     for attempt in range(max_attempts):
         try:
+            # Ошибки, которые видны без запуска, сразу отправляем на исправление
+            problems = preflight_check(last_code)
+            if problems:
+                # Сначала пробуем дешевое локальное исправление, и только потом LLM
+                repaired, fixes = repair_code(last_code)
+                if fixes:
+                    logger.info(f"Код исправлен локально: {'; '.join(fixes)}")
+                    last_code = repaired
+                    problems = preflight_check(last_code)
+            if problems:
+                diagram_failures.inc(reason="preflight")
+                raise Exception(format_problems(problems))
             path = await diagram_generator.generate_diagram(last_code, user_id)
-            return path
+            diagram_attempts.observe(attempt + 1)
+            return path, last_code, None
         except Exception as e:
             last_error = str(e)
             if attempt < max_attempts - 1:
                 # Просим LLM-провайдера исправить код
                 try:
-                    last_code = await llm_client.fix_code(last_code, last_error)
+                    with track_llm(llm_client.provider, "fix"):
+                        last_code = await llm_client.fix_code(last_code, last_error)
                 except Exception as fix_e:
                     last_error += f"\nОшибка при обращении к LLM-провайдеру для исправления: {fix_e}"
                     break
-    return None, last_code, last_error
\ No newline at end of file
+    return None, last_code, last_error
+
+async def generate_diagram_speculative(candidates: List[str], user_id: int, llm_client, max_attempts: int = 3):
+    """
+    Рендерит несколько вариантов кода параллельно (каждый со своими попытками исправления)
+    и возвращает результат первого успешного, остальные отменяются.
+    Формат результата тот же, что у generate_diagram_with_retries; если не удался ни один
+    вариант, возвращается неудача первого по порядку кандидата.
+    У каждого кандидата свой клиент LLM: параллельные исправления не перетирают
+    друг другу last_error_details и прочее состояние клиента. Первый кандидат
+    использует переданный llm_client, чтобы его диагностика осталась у вызывающего.
+    """
+    clients = [llm_client] + [clone_llm_client(llm_client) for _ in candidates[1:]]
+    tasks = [
+        asyncio.ensure_future(generate_diagram_with_retries(candidate, user_id, client, max_attempts))
+        for candidate, client in zip(candidates, clients)
+    ]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                path, last_code, last_error = task.result()
+                if path:
+                    return path, last_code, None
+        return tasks[0].result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
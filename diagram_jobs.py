@@ -0,0 +1,88 @@
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+from config import LLM_STREAMING, SPECULATIVE_CANDIDATES
+from diagram_generator import generate_diagram_with_retries, generate_diagram_speculative
+from llm_cache import llm_response_cache
+from llm_clients import create_llm_client
+from metrics import track_llm
+from user_store import user_store
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+
+class DiagramJobError(Exception):
+    """Задание упало с ошибкой; error_details — диагностика запроса к API (если есть)"""
+
+    def __init__(self, message: str, error_details: Optional[dict] = None):
+        super().__init__(message)
+        self.error_details = error_details
+
+
+async def run_diagram_request(llm_client, request_text: str, user_id: int, use_cache: bool = True,
+                              on_generation_progress: Optional[ProgressCallback] = None,
+                              on_render_start: Optional[Callable[[], Awaitable[None]]] = None
+                              ) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Генерирует код диаграммы (или берет проверенный код из кэша) и рендерит его с повторными попытками.
+
+    Возвращает (путь к изображению, код, None) при успехе и
+    (None, последний вариант кода, ошибка) — если рабочий скрипт получить не удалось.
+    """
+    cache_key = (llm_client.provider, llm_client.get_current_model(), request_text, llm_client.get_prompt_version())
+    diagram_code = await llm_response_cache.get(*cache_key) if use_cache else None
+    candidates = None
+    if diagram_code is None:
+        with track_llm(llm_client.provider, "generate"):
+            if SPECULATIVE_CANDIDATES > 1:
+                # Несколько вариантов сразу: рендерим параллельно и берем первый удачный
+                candidates = await llm_client.generate_diagram_candidates(request_text, SPECULATIVE_CANDIDATES)
+                diagram_code = candidates[0]
+            elif LLM_STREAMING and on_generation_progress is not None:
+                diagram_code = await llm_client.generate_diagram_code_stream(request_text, on_generation_progress)
+            else:
+                diagram_code = await llm_client.generate_diagram_code(request_text)
+    if on_render_start is not None:
+        await on_render_start()
+
+    if candidates and len(candidates) > 1:
+        diagram_path, last_code, last_error = await generate_diagram_speculative(
+            candidates, user_id, llm_client, max_attempts=3
+        )
+    else:
+        diagram_path, last_code, last_error = await generate_diagram_with_retries(
+            diagram_code, user_id, llm_client, max_attempts=3
+        )
+    if diagram_path and last_code:
+        # Кэшируем тот вариант кода, который действительно отрендерился
+        if use_cache:
+            await llm_response_cache.put(*cache_key, last_code)
+        return diagram_path, last_code, None
+    return None, last_code, last_error
+
+
+async def execute_job(job: dict) -> dict:
+    """Выполняет задание из очереди и возвращает результат для бота.
+
+    job: {"user_id", "request", "provider", "model", "use_cache"}. Ключ API
+    берется из user_store, чтобы не хранить его в очереди. Изображение
+    возвращается байтами: бот не зависит от каталогов и кэша рендера воркера.
+    """
+    user_id = job["user_id"]
+    user = await user_store.get(user_id)
+    if not user or not user["api_key"]:
+        return {"status": "error", "error": "API ключ не найден. Установите ключ заново.", "error_details": None}
+    llm_client = create_llm_client(job["provider"], user["api_key"], job.get("model"))
+    try:
+        diagram_path, code, error = await run_diagram_request(
+            llm_client, job["request"], user_id, use_cache=job.get("use_cache", True)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка выполнения задания пользователя {user_id}: {e}")
+        return {"status": "error", "error": str(e), "error_details": llm_client.get_last_error_details()}
+    if diagram_path is None:
+        return {"status": "failed", "code": code, "error": error}
+    path = Path(diagram_path)
+    return {"status": "done", "code": code, "image": path.read_bytes(), "suffix": path.suffix}
@@ -0,0 +1,486 @@
+"""
+Рендер диаграмм без выполнения Python-кода.
+
+Код, сгенерированный LLM, разбирается в дерево (ast) и интерпретируется
+статически: поддерживаются импорты diagrams, блоки with Diagram/Cluster,
+создание узлов и Edge, присваивания, списки и связи >>, << и -. Граф строится
+теми же правилами, что и в diagrams (классы ниже повторяют diagrams.Node, Edge,
+Cluster и Diagram), и отдается в dot одним вызовом. Иконки берутся из индекса
+узлов, без импорта модулей diagrams.
+
+Если в коде есть что-то другое (циклы, функции, Custom и т.п.), поднимается
+UnsupportedCode, и диаграмма рендерится обычным выполнением скрипта.
+"""
+
+import ast
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from node_index import node_index
+
+OUTPUT_FORMATS = ("png", "jpg")
+
+
+class UnsupportedCode(Exception):
+    """Код нельзя построить без выполнения"""
+
+
+class _Diagram:
+    _default_graph_attrs = {
+        "pad": "2.0",
+        "splines": "ortho",
+        "nodesep": "0.60",
+        "ranksep": "0.75",
+        "fontname": "Sans-Serif",
+        "fontsize": "15",
+        "fontcolor": "#2D3436",
+    }
+    _default_node_attrs = {
+        "shape": "box",
+        "style": "rounded",
+        "fixedsize": "true",
+        "width": "1.4",
+        "height": "1.4",
+        "labelloc": "b",
+        "imagescale": "true",
+        "fontname": "Sans-Serif",
+        "fontsize": "13",
+        "fontcolor": "#2D3436",
+    }
+    _default_edge_attrs = {
+        "color": "#7B8894",
+    }
+
+    def __init__(self, name: str = "", filename: str = "", direction: str = "LR", curvestyle: str = "ortho",
+                 outformat: str = "png", autolabel: bool = False, show: bool = True, strict: bool = False,
+                 graph_attr: Optional[dict] = None, node_attr: Optional[dict] = None,
+                 edge_attr: Optional[dict] = None):
+        from graphviz import Digraph
+
+        if direction.upper() not in ("TB", "BT", "LR", "RL"):
+            raise ValueError(f'"{direction}" is not a valid direction')
+        if curvestyle.lower() not in ("ortho", "curved"):
+            raise ValueError(f'"{curvestyle}" is not a valid curvestyle')
+        if not isinstance(outformat, str) or outformat.lower() not in OUTPUT_FORMATS:
+            raise UnsupportedCode(f"формат {outformat!r} строится только выполнением кода")
+        self.name = name
+        self.outformat = outformat.lower()
+        self.autolabel = autolabel
+        self.dot = Digraph(name, strict=strict)
+        self.dot.graph_attr.update(self._default_graph_attrs)
+        self.dot.graph_attr["label"] = name
+        self.dot.node_attr.update(self._default_node_attrs)
+        self.dot.edge_attr.update(self._default_edge_attrs)
+        self.dot.graph_attr["rankdir"] = direction
+        self.dot.graph_attr["splines"] = curvestyle
+        self.dot.graph_attr.update(graph_attr or {})
+        self.dot.node_attr.update(node_attr or {})
+        self.dot.edge_attr.update(edge_attr or {})
+
+    def node(self, nodeid: str, label: str, **attrs):
+        self.dot.node(nodeid, label=label, **attrs)
+
+    def connect(self, node: "_Node", node2: "_Node", edge: "_Edge"):
+        self.dot.edge(node.nodeid, node2.nodeid, **edge.attrs)
+
+    def subgraph(self, dot):
+        self.dot.subgraph(dot)
+
+
+class _Cluster:
+    _bgcolors = ("#E5F5FD", "#EBF3E7", "#ECE8F6", "#FDF7E3")
+    _default_graph_attrs = {
+        "shape": "box",
+        "style": "rounded",
+        "labeljust": "l",
+        "pencolor": "#AEB6BE",
+        "fontname": "Sans-Serif",
+        "fontsize": "12",
+    }
+
+    def __init__(self, context: "_Interpreter", label: str = "cluster", direction: str = "LR",
+                 graph_attr: Optional[dict] = None):
+        from graphviz import Digraph
+
+        if context.diagram is None:
+            raise UnsupportedCode("Cluster вне Diagram")
+        if direction.upper() not in ("TB", "BT", "LR", "RL"):
+            raise ValueError(f'"{direction}" is not a valid direction')
+        self.label = label
+        self.dot = Digraph("cluster_" + label)
+        self.dot.graph_attr.update(self._default_graph_attrs)
+        self.dot.graph_attr["label"] = label
+        self.dot.graph_attr["rankdir"] = direction
+        self._diagram = context.diagram
+        self._parent = context.cluster
+        self.depth = self._parent.depth + 1 if self._parent else 0
+        self.dot.graph_attr["bgcolor"] = self._bgcolors[self.depth % len(self._bgcolors)]
+        self.dot.graph_attr.update(graph_attr or {})
+
+    def close(self):
+        (self._parent or self._diagram).subgraph(self.dot)
+
+    def node(self, nodeid: str, label: str, **attrs):
+        self.dot.node(nodeid, label=label, **attrs)
+
+    def subgraph(self, dot):
+        self.dot.subgraph(dot)
+
+
+class _Node:
+    """Узел diagrams: icon и height берутся из индекса узлов"""
+
+    def __init__(self, context: "_Interpreter", class_name: str, icon: Optional[str], height: float,
+                 label: str = "", *, nodeid: str = None, **attrs):
+        if context.diagram is None:
+            raise UnsupportedCode("узел вне Diagram")
+        self._id = nodeid or uuid.uuid4().hex
+        self.label = label
+        self._diagram = context.diagram
+        if self._diagram.autolabel:
+            self.label = class_name + "\n" + self.label if self.label else class_name
+        padding = 0.4 * (self.label.count('\n'))
+        self._attrs = {
+            "shape": "none",
+            "height": str(height + padding),
+            "image": icon,
+        } if icon else {}
+        self._attrs.update(attrs)
+        (context.cluster or self._diagram).node(self._id, self.label, **self._attrs)
+
+    @property
+    def nodeid(self) -> str:
+        return self._id
+
+    def connect(self, node: "_Node", edge: "_Edge") -> "_Node":
+        self._diagram.connect(self, node, edge)
+        return node
+
+    def __sub__(self, other):
+        if isinstance(other, list):
+            for node in other:
+                self.connect(node, _Edge(self))
+            return other
+        elif isinstance(other, _Node):
+            return self.connect(other, _Edge(self))
+        else:
+            other.node = self
+            return other
+
+    def __rsub__(self, other):
+        for o in other:
+            if isinstance(o, _Edge):
+                o.connect(self)
+            else:
+                o.connect(self, _Edge(self))
+        return self
+
+    def __rshift__(self, other):
+        if isinstance(other, list):
+            for node in other:
+                self.connect(node, _Edge(self, forward=True))
+            return other
+        elif isinstance(other, _Node):
+            return self.connect(other, _Edge(self, forward=True))
+        else:
+            other.forward = True
+            other.node = self
+            return other
+
+    def __lshift__(self, other):
+        if isinstance(other, list):
+            for node in other:
+                self.connect(node, _Edge(self, reverse=True))
+            return other
+        elif isinstance(other, _Node):
+            return self.connect(other, _Edge(self, reverse=True))
+        else:
+            other.reverse = True
+            return other.connect(self)
+
+    def __rrshift__(self, other):
+        for o in other:
+            if isinstance(o, _Edge):
+                o.forward = True
+                o.connect(self)
+            else:
+                o.connect(self, _Edge(self, forward=True))
+        return self
+
+    def __rlshift__(self, other):
+        for o in other:
+            if isinstance(o, _Edge):
+                o.reverse = True
+                o.connect(self)
+            else:
+                o.connect(self, _Edge(self, reverse=True))
+        return self
+
+
+class _Edge:
+    _default_edge_attrs = {
+        "fontcolor": "#2D3436",
+        "fontname": "Sans-Serif",
+        "fontsize": "13",
+    }
+
+    def __init__(self, node: "_Node" = None, forward: bool = False, reverse: bool = False, label: str = "",
+                 color: str = "", style: str = "", **attrs):
+        if node is not None and not isinstance(node, _Node):
+            raise UnsupportedCode("Edge(node=...) ожидает узел")
+        self.node = node
+        self.forward = forward
+        self.reverse = reverse
+        self._attrs = dict(self._default_edge_attrs)
+        if label:
+            self._attrs["label"] = label
+        if color:
+            self._attrs["color"] = color
+        if style:
+            self._attrs["style"] = style
+        self._attrs.update(attrs)
+
+    def __sub__(self, other):
+        return self.connect(other)
+
+    def __rsub__(self, other):
+        return self.append(other)
+
+    def __rshift__(self, other):
+        self.forward = True
+        return self.connect(other)
+
+    def __lshift__(self, other):
+        self.reverse = True
+        return self.connect(other)
+
+    def __rrshift__(self, other):
+        return self.append(other, forward=True)
+
+    def __rlshift__(self, other):
+        return self.append(other, reverse=True)
+
+    def append(self, other, forward=None, reverse=None) -> List["_Edge"]:
+        result = []
+        for o in other:
+            if isinstance(o, _Edge):
+                o.forward = forward if forward else o.forward
+                o.reverse = forward if forward else o.reverse
+                self._attrs = o.attrs.copy()
+                result.append(o)
+            else:
+                result.append(_Edge(o, forward=forward, reverse=reverse, **self._attrs))
+        return result
+
+    def connect(self, other):
+        if isinstance(other, list):
+            for node in other:
+                self.node.connect(node, self)
+            return other
+        elif isinstance(other, _Edge):
+            self._attrs = other._attrs.copy()
+            return self
+        else:
+            if self.node is not None:
+                return self.node.connect(other, self)
+            else:
+                self.node = other
+                return self
+
+    @property
+    def attrs(self) -> Dict[str, str]:
+        if self.forward and self.reverse:
+            direction = "both"
+        elif self.forward:
+            direction = "forward"
+        elif self.reverse:
+            direction = "back"
+        else:
+            direction = "none"
+        return {**self._attrs, "dir": direction}
+
+
+# Классы самого пакета diagrams, которые понимает интерпретатор
+CONTEXT_CLASSES = {"Diagram", "Cluster", "Group"}
+GRAPH_OPERATORS = {ast.RShift: lambda a, b: a >> b, ast.LShift: lambda a, b: a << b, ast.Sub: lambda a, b: a - b}
+
+
+class _Interpreter:
+    """Выполняет поддерживаемое подмножество Python над классами-двойниками diagrams"""
+
+    def __init__(self):
+        self.env: Dict[str, Any] = {}
+        self.classes: Dict[str, Tuple] = {}  # локальное имя -> ("Diagram"|"Cluster"|"Edge"|"Node", данные узла)
+        self.diagram: Optional[_Diagram] = None
+        self.cluster: Optional[_Cluster] = None
+        self.finished: List[_Diagram] = []
+
+    def run(self, tree: ast.Module):
+        for statement in tree.body:
+            self.exec_statement(statement)
+
+    def exec_statement(self, node: ast.stmt):
+        if isinstance(node, ast.ImportFrom):
+            self.exec_import(node)
+        elif isinstance(node, ast.With):
+            self.exec_with(node)
+        elif isinstance(node, ast.Assign):
+            value = self.eval(node.value)
+            for target in node.targets:
+                self.assign(target, value)
+        elif isinstance(node, ast.Expr):
+            self.eval(node.value)
+        elif not isinstance(node, ast.Pass):
+            raise UnsupportedCode(f"строка {node.lineno}: {type(node).__name__}")
+
+    def exec_import(self, node: ast.ImportFrom):
+        module = node.module or ""
+        for alias in node.names:
+            local_name = alias.asname or alias.name
+            if module == "diagrams" and alias.name in CONTEXT_CLASSES | {"Edge"}:
+                kind = "Cluster" if alias.name == "Group" else alias.name
+                self.classes[local_name] = (kind, None)
+            elif module == "diagrams" and alias.name == "Node":
+                self.classes[local_name] = ("Node", ("Node", None, 1.9))
+            else:
+                info = node_index.node_info(module, alias.name) if module.startswith("diagrams.") else None
+                if info is None:
+                    raise UnsupportedCode(f"строка {node.lineno}: {module}.{alias.name}")
+                icon, height = info
+                self.classes[local_name] = ("Node", (alias.name, icon, height))
+
+    def exec_with(self, node: ast.With):
+        opened = []
+        for item in node.items:
+            call = item.context_expr
+            kind = self._class_kind(call)
+            if kind not in ("Diagram", "Cluster"):
+                raise UnsupportedCode(f"строка {node.lineno}: with без Diagram/Cluster")
+            args, kwargs = self._eval_arguments(call)
+            if kind == "Diagram":
+                if self.diagram is not None:
+                    raise UnsupportedCode("вложенный Diagram")
+                context = _Diagram(*args, **kwargs)
+                self.diagram = context
+            else:
+                context = _Cluster(self, *args, **kwargs)
+                self.cluster = context
+            opened.append(context)
+            if item.optional_vars is not None:
+                self.assign(item.optional_vars, context)
+        for statement in node.body:
+            self.exec_statement(statement)
+        for context in reversed(opened):
+            if isinstance(context, _Cluster):
+                context.close()
+                self.cluster = context._parent
+            else:
+                self.finished.append(context)
+                self.diagram = None
+
+    def assign(self, target: ast.expr, value: Any):
+        if isinstance(target, ast.Name):
+            self.env[target.id] = value
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            values = list(value)
+            if len(values) != len(target.elts):
+                raise UnsupportedCode(f"строка {target.lineno}: распаковка другой длины")
+            for element, element_value in zip(target.elts, values):
+                self.assign(element, element_value)
+        else:
+            raise UnsupportedCode(f"строка {target.lineno}: присваивание в {type(target).__name__}")
+
+    def _class_kind(self, node: ast.expr) -> Optional[str]:
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self.classes:
+            return self.classes[node.func.id][0]
+        return None
+
+    def _eval_arguments(self, call: ast.Call):
+        args = []
+        for arg in call.args:
+            if isinstance(arg, ast.Starred):
+                raise UnsupportedCode(f"строка {call.lineno}: *args")
+            args.append(self.eval(arg))
+        kwargs = {}
+        for keyword in call.keywords:
+            if keyword.arg is None:
+                raise UnsupportedCode(f"строка {call.lineno}: **kwargs")
+            kwargs[keyword.arg] = self.eval(keyword.value)
+        return args, kwargs
+
+    def eval(self, node: ast.expr) -> Any:
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in self.env:
+                raise UnsupportedCode(f"строка {node.lineno}: имя {node.id}")
+            return self.env[node.id]
+        if isinstance(node, ast.List):
+            return [self.eval(element) for element in node.elts]
+        if isinstance(node, ast.Tuple):
+            return tuple(self.eval(element) for element in node.elts)
+        if isinstance(node, ast.Dict) and None not in node.keys:
+            return {self.eval(key): self.eval(value) for key, value in zip(node.keys, node.values)}
+        if isinstance(node, ast.JoinedStr):
+            return self._eval_fstring(node)
+        if isinstance(node, ast.BinOp):
+            left, right = self.eval(node.left), self.eval(node.right)
+            operator = GRAPH_OPERATORS.get(type(node.op))
+            if operator is not None and not isinstance(left, (str, int, float)):
+                return operator(left, right)
+            if isinstance(node.op, ast.Add) and isinstance(left, str) and isinstance(right, str):
+                return left + right
+            raise UnsupportedCode(f"строка {node.lineno}: операция {type(node.op).__name__}")
+        if isinstance(node, ast.Call):
+            kind = self._class_kind(node)
+            args, kwargs = self._eval_arguments(node)
+            if kind == "Node":
+                class_name, icon, height = self.classes[node.func.id][1]
+                return _Node(self, class_name, icon, height, *args, **kwargs)
+            if kind == "Edge":
+                return _Edge(*args, **kwargs)
+        raise UnsupportedCode(f"строка {getattr(node, 'lineno', '?')}: {type(node).__name__}")
+
+    def _eval_fstring(self, node: ast.JoinedStr) -> str:
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            elif isinstance(value, ast.FormattedValue) and value.conversion == -1 and value.format_spec is None:
+                result = self.eval(value.value)
+                if not isinstance(result, (str, int, float)):
+                    raise UnsupportedCode(f"строка {node.lineno}: f-строка с объектом")
+                parts.append(str(result))
+            else:
+                raise UnsupportedCode(f"строка {node.lineno}: сложная f-строка")
+        return "".join(parts)
+
+
+def build_dot(code: str) -> Tuple[str, str]:
+    """Строит DOT-описание диаграммы без выполнения кода.
+
+    Возвращает (исходник DOT, формат изображения). Если код выходит за
+    поддерживаемое подмножество или с ним что-то не так, поднимает
+    UnsupportedCode — тогда диаграмму нужно рендерить выполнением скрипта,
+    которое заодно даст пользователю настоящий текст ошибки.
+    """
+    if not node_index.available:
+        raise UnsupportedCode("индекс узлов diagrams недоступен")
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        raise UnsupportedCode(f"синтаксическая ошибка: {e}")
+    interpreter = _Interpreter()
+    try:
+        interpreter.run(tree)
+    except UnsupportedCode:
+        raise
+    except ImportError:
+        raise UnsupportedCode("пакет graphviz не установлен")
+    except Exception as e:
+        raise UnsupportedCode(f"{type(e).__name__}: {e}")
+    if not interpreter.finished:
+        raise UnsupportedCode("нет блока with Diagram(...)")
+    # Как и при выполнении скрипта, берем последнюю диаграмму
+    diagram = interpreter.finished[-1]
+    return diagram.dot.source, diagram.outformat
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Локальная проверка вебхук-режима без Telegram.
+
+Поднимает поддельный сервер Bot API (отвечает на sendMessage, editMessageText,
+sendPhoto и т.д. и печатает, что прислал бот) и отправляет боту обновления
+на вебхук с секретным заголовком, как это делает Telegram.
+
+Запуск бота против поддельного сервера:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123456:TEST \\
+    BOT_MODE=webhook WEBHOOK_SECRET=secret python main.py
+
+Отправка обновлений (текст — сообщение, "cb:<data>" — нажатие кнопки):
+
+    python fake_telegram.py --secret secret /start cb:create_diagram "Веб-архитектура с базой данных"
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+from aiohttp import web
+
+USER = {"id": 1, "is_bot": False, "first_name": "Tester"}
+CHAT = {"id": 1, "type": "private"}
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeBotApi:
+    """Поддельный Bot API: на любой метод отвечает правдоподобным результатом"""
+
+    def __init__(self):
+        self.message_ids = itertools.count(1000)
+        self.last_message_id = None
+
+    def _message(self, fields: dict) -> dict:
+        message_id = int(fields.get("message_id") or next(self.message_ids))
+        self.last_message_id = message_id
+        message = {"message_id": message_id, "date": int(time.time()), "chat": CHAT, "from": BOT_USER}
+        if "text" in fields:
+            message["text"] = fields["text"]
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        fields = {key: value for key, value in (await request.post()).items() if isinstance(value, str)}
+        shown = fields.get("text") or fields.get("caption") or ""
+        print(f"⬅️  {method}: {shown[:300]}")
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(fields)
+        elif method in ("sendPhoto", "sendDocument"):
+            result = self._message(fields)
+            counter = result["message_id"]
+            result["photo"] = [{"file_id": f"fake-photo-{counter}", "file_unique_id": f"u{counter}",
+                                "width": 1, "height": 1}]
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+async def send_updates(webhook_url: str, secret: str, items, api: FakeBotApi, delay: float):
+    update_ids = itertools.count(1)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with aiohttp.ClientSession() as session:
+        for item in items:
+            update = {"update_id": next(update_ids)}
+            if item.startswith("cb:"):
+                update["callback_query"] = {
+                    "id": str(update["update_id"]), "from": USER, "chat_instance": "1", "data": item[3:],
+                    "message": {"message_id": api.last_message_id or 1, "date": int(time.time()),
+                                "chat": CHAT, "from": BOT_USER, "text": "..."},
+                }
+            else:
+                update["message"] = {"message_id": update["update_id"], "date": int(time.time()),
+                                     "chat": CHAT, "from": USER, "text": item}
+            async with session.post(webhook_url, json=update, headers=headers) as response:
+                print(f"➡️  {item!r}: HTTP {response.status}")
+            await asyncio.sleep(delay)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Поддельный Telegram для проверки вебхука")
+    parser.add_argument("items", nargs="*", help="тексты сообщений или cb:<callback_data>")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook", help="адрес вебхука бота")
+    parser.add_argument("--secret", default="", help="значение WEBHOOK_SECRET бота")
+    parser.add_argument("--api-port", type=int, default=8081, help="порт поддельного Bot API")
+    parser.add_argument("--delay", type=float, default=2.0, help="пауза между обновлениями, с")
+    parser.add_argument("--wait", type=float, default=60.0, help="сколько ждать ответов бота после отправки, с")
+    args = parser.parse_args()
+
+    api = FakeBotApi()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    print(f"🤖 Поддельный Bot API: http://127.0.0.1:{args.api_port}")
+    try:
+        await send_updates(args.webhook, args.secret, args.items, api, args.delay)
+        await asyncio.sleep(args.wait)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from config import FSM_DB_FILE, FSM_STATE_TTL, FSM_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram в SQLite (режим WAL).
+
+    Состояния (ожидание ключа API, запроса на диаграмму) переживают
+    перезапуск, а несколько процессов бота с общим файлом видят одни и те же
+    состояния. Изменения копятся в памяти и записываются одной транзакцией
+    раз в flush_interval секунд; до записи они видны из этого же процесса.
+    Состояние, которое не менялось дольше ttl секунд, считается сброшенным
+    и удаляется при очередной записи.
+    """
+
+    def __init__(self, path: str = FSM_DB_FILE, ttl: float = FSM_STATE_TTL,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, key_builder: Optional[KeyBuilder] = None):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._conn: Optional[sqlite3.Connection] = None
+        # Еще не записанные изменения: ключ -> (значение, время изменения)
+        self._pending_states: Dict[str, tuple] = {}
+        self._pending_data: Dict[str, tuple] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # Один поток: SQLite-соединение используется строго последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm_storage")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                " key TEXT PRIMARY KEY,"
+                " state TEXT,"
+                " data TEXT NOT NULL DEFAULT '{}',"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _is_expired(self, updated_at: float) -> bool:
+        return self.ttl > 0 and time.time() - updated_at > self.ttl
+
+    def _read_sync(self, key: str):
+        return self._connect().execute("SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)).fetchone()
+
+    async def _read(self, key: str):
+        row = await self._run(self._read_sync, key)
+        if row is None or self._is_expired(row[2]):
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _flush_sync(self, states: Dict[str, tuple], data: Dict[str, tuple]):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                [(key, state, updated_at) for key, (state, updated_at) in states.items()]
+            )
+            conn.executemany(
+                "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(key, json.dumps(value, ensure_ascii=False), updated_at) for key, (value, updated_at) in data.items()]
+            )
+            # Сброшенные и устаревшие состояния не храним
+            conn.execute("DELETE FROM fsm WHERE state IS NULL AND data = '{}'")
+            if self.ttl > 0:
+                conn.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._pending_states and not self._pending_data:
+            return
+        states, self._pending_states = self._pending_states, {}
+        data, self._pending_data = self._pending_data, {}
+        try:
+            await self._run(self._flush_sync, states, data)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояния FSM: {e}")
+            # Вернем изменения в буфер, не затирая более свежие
+            self._pending_states = {**states, **self._pending_states}
+            self._pending_data = {**data, **self._pending_data}
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        await self.flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        self._pending_states[self.key_builder.build(key)] = (value, time.time())
+        self._schedule_flush()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        storage_key = self.key_builder.build(key)
+        pending = self._pending_states.get(storage_key)
+        if pending is not None:
+            return pending[0]
+        state, _ = await self._read(storage_key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._pending_data[self.key_builder.build(key)] = (data.copy(), time.time())
+        self._schedule_flush()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        storage_key = self.key_builder.build(key)
+        pending = self._pending_data.get(storage_key)
+        if pending is not None:
+            return pending[0].copy()
+        _, data = await self._read(storage_key)
+        return data
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        await self._run(self._close_sync)
@@ -3,14 +3,49 @@ import aiohttp
 import json
 import time
 import base64
+import functools
+import hashlib
 import urllib.parse
 import uuid
-from typing import Optional, Dict, Any, Tuple
-from config import GIGACHAT_AUTH_URL, GIGACHAT_BASE_URL, GIGACHAT_SYSTEM_PROMPT
-from base_llm_client import BaseLLMClient
+from typing import Optional, Dict, Any, List, Tuple
+from config import (GIGACHAT_AUTH_URL, GIGACHAT_BASE_URL, GIGACHAT_SYSTEM_PROMPT, GIGACHAT_PROMPT_CACHE,
+                    SPECULATIVE_TEMPERATURE)
+from base_llm_client import BaseLLMClient, ProgressCallback
+from token_cache import token_cache
+from metrics import track_llm
+from http_session import http_sessions
+from prompt_builder import prompt_builder
+
+
+# Известные модели GigaChat на случай, если /models недоступен
+GIGACHAT_DEFAULT_MODELS = [
+    {"id": "GigaChat", "description": "Базовая модель GigaChat"},
+    {"id": "GigaChat-Pro", "description": "Продвинутая модель GigaChat-Pro"},
+    {"id": "GigaChat-Max", "description": "Максимальная модель GigaChat-Max"},
+]
+
+
+class TokenRejectedError(Exception):
+    """GigaChat отклонил access token (401): его отозвали раньше expires_at"""
+
+
+def retry_on_rejected_token(method):
+    """Повторяет запрос один раз с новым токеном, если GigaChat ответил 401"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await method(self, *args, **kwargs)
+        except TokenRejectedError:
+            token_cache.invalidate(self.client_secret)
+            return await method(self, *args, **kwargs)
+    return wrapper
 
 
 class GigaChatClient(BaseLLMClient):
+    provider = "gigachat"
+    system_prompt = GIGACHAT_SYSTEM_PROMPT
+    default_models = GIGACHAT_DEFAULT_MODELS
+    
     def __init__(self):
         super().__init__()
         self.access_token: Optional[str] = None
@@ -26,6 +61,10 @@ class GigaChatClient(BaseLLMClient):
         self.token_expires_at = 0
         self.last_error_details = None
     
+    def get_credentials(self) -> Optional[str]:
+        """Возвращает учетные данные, с которыми создан клиент"""
+        return self.client_secret
+    
     def set_model(self, model_id: str):
         """Устанавливает модель для генерации"""
         self.selected_model = model_id
@@ -34,10 +73,20 @@ class GigaChatClient(BaseLLMClient):
         """Возвращает текущую выбранную модель"""
         return self.selected_model
     
+    def get_prompt_version(self) -> str:
+        """Версия промпта учитывает и режим его сборки (полный/компактный)"""
+        return f"{prompt_builder.mode}-{super().get_prompt_version()}"
+    
     def get_last_error_details(self) -> Optional[Dict[str, Any]]:
         """Возвращает детали последней ошибки"""
         return self.last_error_details
     
+    def _check_token_rejected(self, status: int):
+        """Ответ 401 на запрос к API означает, что закэшированный токен больше не действует"""
+        if status == 401:
+            self.last_error_details['error'] = "Ошибка API: 401 - токен отклонен"
+            raise TokenRejectedError("Ошибка API: 401 - токен отклонен")
+    
     def _generate_curl_command(self, method: str, url: str, headers: Dict[str, str], data: Any = None) -> str:
         """Генерирует curl команду для отладки"""
         curl_parts = [f"curl --location '{url}'"]
@@ -58,14 +107,20 @@ class GigaChatClient(BaseLLMClient):
         return " \\\n  ".join(curl_parts)
     
     async def _get_access_token(self) -> str:
-        """Получает access token для API"""
+        """Получает access token для API (из общего кэша или через OAuth)"""
         if not self.client_secret:
             raise ValueError("Client secret не установлен")
-            
-        # Проверяем, не истек ли токен
-        if self.access_token and time.time() < self.token_expires_at:
-            return self.access_token
-            
+        
+        async def fetch():
+            with track_llm(self.provider, "auth"):
+                return await self._fetch_access_token()
+        
+        self.access_token = await token_cache.get_token(self.client_secret, fetch)
+        self.token_expires_at = token_cache.get_expires_at(self.client_secret)
+        return self.access_token
+    
+    async def _fetch_access_token(self) -> Tuple[str, float]:
+        """Запрашивает новый access token. Возвращает (token, expires_at в секундах)"""
         headers = {
             'Content-Type': 'application/x-www-form-urlencoded',
             'Accept': 'application/json',
@@ -91,7 +146,7 @@ class GigaChatClient(BaseLLMClient):
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_sessions.session("gigachat") as session:
                 async with session.post(
                     GIGACHAT_AUTH_URL,
                     headers=headers,
@@ -124,18 +179,21 @@ class GigaChatClient(BaseLLMClient):
                         raise Exception(error_msg)
                         
                     result = json.loads(response_text)
-                    self.access_token = result['access_token']
+                    access_token = result['access_token']
                     # Используем expires_at вместо expires_in
                     if 'expires_at' in result:
-                        self.token_expires_at = float(result['expires_at'])
+                        expires_at = float(result['expires_at'])
+                        # GigaChat отдает expires_at в миллисекундах
+                        if expires_at > 1e11:
+                            expires_at /= 1000
                         self.last_error_details['token_expires_at'] = result['expires_at']
                     else:
-                        self.token_expires_at = time.time() + 1800  # fallback: 30 минут
+                        expires_at = time.time() + 1800  # fallback: 30 минут
                         self.last_error_details['token_expires_at'] = 'unknown (fallback 30min)'
                     # Успешная операция
                     self.last_error_details['success'] = True
                     
-                    return self.access_token
+                    return access_token, expires_at
         except aiohttp.ClientError as e:
             self.last_error_details['error'] = f"Ошибка соединения: {str(e)}"
             raise Exception(f"Ошибка соединения: {str(e)}")
@@ -155,6 +213,7 @@ class GigaChatClient(BaseLLMClient):
         except Exception as e:
             return False, str(e)
     
+    @retry_on_rejected_token
     async def get_available_models(self) -> list:
         """Получает список доступных моделей"""
         if not self.client_secret:
@@ -180,7 +239,7 @@ class GigaChatClient(BaseLLMClient):
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_sessions.session("gigachat") as session:
                 async with session.get(
                     f"{GIGACHAT_BASE_URL}/models",
                     headers=headers,
@@ -196,14 +255,11 @@ class GigaChatClient(BaseLLMClient):
                         'response_length': len(response_text)
                     })
                     
+                    self._check_token_rejected(response.status)
                     if response.status != 200:
                         # Если API не поддерживает /models, возвращаем известные модели
                         self.last_error_details['fallback_to_default'] = True
-                        return [
-                            {"id": "GigaChat", "description": "Базовая модель GigaChat"},
-                            {"id": "GigaChat-Pro", "description": "Продвинутая модель GigaChat-Pro"},
-                            {"id": "GigaChat-Max", "description": "Максимальная модель GigaChat-Max"}
-                        ]
+                        return [dict(model) for model in self.default_models]
                         
                     result = json.loads(response_text)
                     
@@ -228,11 +284,7 @@ class GigaChatClient(BaseLLMClient):
                     else:
                         # Фолбэк к известным моделям
                         self.last_error_details['fallback_to_default'] = True
-                        return [
-                            {"id": "GigaChat", "description": "Базовая модель GigaChat"},
-                            {"id": "GigaChat-Pro", "description": "Продвинутая модель GigaChat-Pro"},
-                            {"id": "GigaChat-Max", "description": "Максимальная модель GigaChat-Max"}
-                        ]
+                        return [dict(model) for model in self.default_models]
         except aiohttp.ClientError as e:
             self.last_error_details['error'] = f"Ошибка соединения: {str(e)}"
             raise Exception(f"Ошибка соединения: {str(e)}")
@@ -244,25 +296,26 @@ class GigaChatClient(BaseLLMClient):
                 self.last_error_details['error'] = str(e)
             raise
     
-    async def generate_diagram_code(self, user_request: str) -> str:
-        """Генерирует код диаграммы на основе запроса пользователя"""
-        if not self.client_secret:
-            raise ValueError("API ключ не установлен")
-            
-        access_token = await self._get_access_token()
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
+    @staticmethod
+    def _add_prompt_cache_header(headers: Dict[str, str], payload: Dict[str, Any]):
+        """Включает кэширование контекста GigaChat для одинакового системного промпта.
         
+        Запросы с одним X-Session-ID переиспользуют уже обработанный префикс диалога,
+        поэтому идентификатор строится из хэша системного промпта.
+        """
+        if not GIGACHAT_PROMPT_CACHE:
+            return
+        system_prompt = payload["messages"][0]["content"]
+        headers['X-Session-ID'] = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+    
+    def _generate_payload(self, user_request: str, stream: bool = False) -> Dict[str, Any]:
+        """Тело запроса chat/completions для генерации диаграммы"""
         payload = {
             "model": self.selected_model,
             "messages": [
                 {
                     "role": "system",
-                    "content": GIGACHAT_SYSTEM_PROMPT
+                    "content": prompt_builder.build(user_request)
                 },
                 {
                     "role": "user", 
@@ -272,6 +325,26 @@ class GigaChatClient(BaseLLMClient):
             "max_tokens": 2048,
             "temperature": 0.1
         }
+        if stream:
+            payload["stream"] = True
+        return payload
+    
+    @retry_on_rejected_token
+    async def generate_diagram_code(self, user_request: str) -> str:
+        """Генерирует код диаграммы на основе запроса пользователя"""
+        if not self.client_secret:
+            raise ValueError("API ключ не установлен")
+            
+        access_token = await self._get_access_token()
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {access_token}'
+        }
+        
+        payload = self._generate_payload(user_request)
+        self._add_prompt_cache_header(headers, payload)
         
         # Генерируем curl команду для диагностики
         curl_command = self._generate_curl_command('POST', f"{GIGACHAT_BASE_URL}/chat/completions", headers, payload)
@@ -287,7 +360,7 @@ class GigaChatClient(BaseLLMClient):
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_sessions.session("gigachat") as session:
                 async with session.post(
                     f"{GIGACHAT_BASE_URL}/chat/completions",
                     headers=headers,
@@ -304,6 +377,7 @@ class GigaChatClient(BaseLLMClient):
                         'response_length': len(response_text)
                     })
                     
+                    self._check_token_rejected(response.status)
                     if response.status != 200:
                         error_msg = f"Ошибка API: {response.status}"
                         try:
@@ -329,18 +403,165 @@ class GigaChatClient(BaseLLMClient):
                     self.last_error_details['response_content_length'] = len(content)
                     
                     # Извлекаем код из markdown блока
-                    if '```python' in content:
-                        code_start = content.find('```python') + 9
-                        code_end = content.find('```', code_start)
-                        if code_end != -1:
-                            return content[code_start:code_end].strip()
-                    elif '```' in content:
-                        code_start = content.find('```') + 3
-                        code_end = content.find('```', code_start)
-                        if code_end != -1:
-                            return content[code_start:code_end].strip()
+                    return self._extract_code(content)
+        except aiohttp.ClientError as e:
+            self.last_error_details['error'] = f"Ошибка соединения: {str(e)}"
+            raise Exception(f"Ошибка соединения: {str(e)}")
+        except json.JSONDecodeError as e:
+            self.last_error_details['error'] = f"Ошибка парсинга JSON: {str(e)}"
+            raise Exception(f"Ошибка парсинга ответа: {str(e)}")
+        except Exception as e:
+            if 'error' not in self.last_error_details:
+                self.last_error_details['error'] = str(e)
+            raise
+    
+    @retry_on_rejected_token
+    async def generate_diagram_code_stream(self, user_request: str,
+                                           on_progress: Optional[ProgressCallback] = None) -> str:
+        """Генерирует код диаграммы в потоковом режиме (SSE), сообщая о прогрессе через on_progress"""
+        if not self.client_secret:
+            raise ValueError("API ключ не установлен")
+            
+        access_token = await self._get_access_token()
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'Authorization': f'Bearer {access_token}'
+        }
+        
+        payload = self._generate_payload(user_request, stream=True)
+        self._add_prompt_cache_header(headers, payload)
+        
+        # Генерируем curl команду для диагностики
+        curl_command = self._generate_curl_command('POST', f"{GIGACHAT_BASE_URL}/chat/completions", headers, payload)
+        
+        self.last_error_details = {
+            'operation': 'generate_diagram_code_stream',
+            'url': f"{GIGACHAT_BASE_URL}/chat/completions",
+            'method': 'POST',
+            'headers': {k: ('[MASKED]' if k.lower() == 'authorization' else v) for k, v in headers.items()},
+            'payload': payload,
+            'curl_command': curl_command,
+            'timestamp': time.time()
+        }
+        
+        try:
+            async with http_sessions.session("gigachat") as session:
+                async with session.post(
+                    f"{GIGACHAT_BASE_URL}/chat/completions",
+                    headers=headers,
+                    json=payload,
+                    ssl=False
+                ) as response:
+                    self.last_error_details.update({
+                        'response_status': response.status,
+                        'response_headers': dict(response.headers)
+                    })
+                    
+                    self._check_token_rejected(response.status)
+                    if response.status != 200:
+                        response_text = await response.text()
+                        self.last_error_details['response_text'] = response_text[:1000]
+                        error_msg = f"Ошибка API: {response.status}"
+                        try:
+                            error_data = json.loads(response_text)
+                            if 'error' in error_data:
+                                error_msg += f" - {error_data['error']}"
+                        except:
+                            pass
+                        
+                        self.last_error_details['error'] = error_msg
+                        raise Exception(error_msg)
+                    
+                    content = await self._read_stream(response, on_progress)
+                    
+                    if not content:
+                        self.last_error_details['error'] = "Пустой ответ от API"
+                        raise Exception("Пустой ответ от API")
+                    
+                    # Успешная операция
+                    self.last_error_details['success'] = True
+                    self.last_error_details['response_content_length'] = len(content)
+                    
+                    # Извлекаем код из markdown блока
+                    return self._extract_code(content)
+        except aiohttp.ClientError as e:
+            self.last_error_details['error'] = f"Ошибка соединения: {str(e)}"
+            raise Exception(f"Ошибка соединения: {str(e)}")
+        except Exception as e:
+            if 'error' not in self.last_error_details:
+                self.last_error_details['error'] = str(e)
+            raise
+    
+    @retry_on_rejected_token
+    async def generate_diagram_candidates(self, user_request: str, count: int) -> List[str]:
+        """Запрашивает у GigaChat count вариантов кода одним запросом (параметр n)"""
+        if not self.client_secret:
+            raise ValueError("API ключ не установлен")
+        if count <= 1:
+            return [await self.generate_diagram_code(user_request)]
+            
+        access_token = await self._get_access_token()
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {access_token}'
+        }
+        
+        payload = self._generate_payload(user_request)
+        payload["n"] = count
+        payload["temperature"] = SPECULATIVE_TEMPERATURE
+        self._add_prompt_cache_header(headers, payload)
+        
+        curl_command = self._generate_curl_command('POST', f"{GIGACHAT_BASE_URL}/chat/completions", headers, payload)
+        self.last_error_details = {
+            'operation': 'generate_diagram_candidates',
+            'url': f"{GIGACHAT_BASE_URL}/chat/completions",
+            'method': 'POST',
+            'headers': {k: ('[MASKED]' if k.lower() == 'authorization' else v) for k, v in headers.items()},
+            'payload': payload,
+            'curl_command': curl_command,
+            'timestamp': time.time()
+        }
+        
+        try:
+            async with http_sessions.session("gigachat") as session:
+                async with session.post(
+                    f"{GIGACHAT_BASE_URL}/chat/completions",
+                    headers=headers,
+                    json=payload,
+                    ssl=False
+                ) as response:
+                    response_text = await response.text()
+                    self.last_error_details.update({
+                        'response_status': response.status,
+                        'response_headers': dict(response.headers),
+                        'response_text': response_text[:1000] if len(response_text) > 1000 else response_text,
+                        'response_length': len(response_text)
+                    })
                     
-                    return content.strip()
+                    self._check_token_rejected(response.status)
+                    if response.status != 200:
+                        error_msg = f"Ошибка API: {response.status}"
+                        try:
+                            error_data = json.loads(response_text)
+                            if 'error' in error_data:
+                                error_msg += f" - {error_data['error']}"
+                        except:
+                            pass
+                        
+                        self.last_error_details['error'] = error_msg
+                        raise Exception(error_msg)
+                    
+                    candidates = self._unique_candidates(json.loads(response_text))
+                    if not candidates:
+                        self.last_error_details['error'] = "Пустой ответ от API"
+                        raise Exception("Пустой ответ от API")
+                    
+                    self.last_error_details['success'] = True
+                    return candidates
         except aiohttp.ClientError as e:
             self.last_error_details['error'] = f"Ошибка соединения: {str(e)}"
             raise Exception(f"Ошибка соединения: {str(e)}")
@@ -352,6 +573,7 @@ class GigaChatClient(BaseLLMClient):
                 self.last_error_details['error'] = str(e)
             raise
     
+    @retry_on_rejected_token
     async def fix_code(self, code_with_error: str, error_message: str) -> str:
         """Отправляет в Гигачат код с ошибкой и текст ошибки, просит исправить скрипт."""
         if not self.client_secret:
@@ -367,7 +589,7 @@ class GigaChatClient(BaseLLMClient):
             "messages": [
                 {
                     "role": "system",
-                    "content": GIGACHAT_SYSTEM_PROMPT
+                    "content": prompt_builder.build(code_with_error + "\n" + error_message)
                 },
                 {
                     "role": "user",
@@ -385,6 +607,7 @@ class GigaChatClient(BaseLLMClient):
             "max_tokens": 2048,
             "temperature": 0.1
         }
+        self._add_prompt_cache_header(headers, payload)
         curl_command = self._generate_curl_command('POST', f"{GIGACHAT_BASE_URL}/chat/completions", headers, payload)
         self.last_error_details = {
             'operation': 'fix_code',
@@ -396,7 +619,7 @@ class GigaChatClient(BaseLLMClient):
             'timestamp': time.time()
         }
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_sessions.session("gigachat") as session:
                 async with session.post(
                     f"{GIGACHAT_BASE_URL}/chat/completions",
                     headers=headers,
@@ -410,6 +633,7 @@ class GigaChatClient(BaseLLMClient):
                         'response_text': response_text[:1000] if len(response_text) > 1000 else response_text,
                         'response_length': len(response_text)
                     })
+                    self._check_token_rejected(response.status)
                     if response.status != 200:
                         error_msg = f"Ошибка API: {response.status}"
                         try:
@@ -428,21 +652,7 @@ class GigaChatClient(BaseLLMClient):
                     self.last_error_details['success'] = True
                     self.last_error_details['response_content_length'] = len(content)
                     # Извлекаем код из markdown блока
-                    if '```python' in content:
-                        code_start = content.find('```python') + 9
-                        code_end = content.find('```', code_start)
-                        if code_end != -1:
-                            return content[code_start:code_end].strip()
-                    elif '```' in content:
-                        code_start = content.find('```') + 3
-                        code_end = content.find('```', code_start)
-                        if code_end != -1:
-                            return content[code_start:code_end].strip()
-                    return content.strip()
+                    return self._extract_code(content)
         except Exception as e:
             self.last_error_details['error'] = str(e)
             raise
-
-
-# Глобальный экземпляр клиента
-gigachat_client = GigaChatClient()
\ No newline at end of file
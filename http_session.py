@@ -0,0 +1,45 @@
+import aiohttp
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from config import HTTP_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL
+
+
+class HttpSessionPool:
+    """Долгоживущие aiohttp-сессии, по одной на провайдера.
+
+    Соединения (и TLS) переиспользуются между запросами вместо того, чтобы
+    открывать новую ClientSession на каждый вызов API.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def get(self, provider: str) -> aiohttp.ClientSession:
+        """Возвращает сессию провайдера, создавая ее при первом обращении"""
+        session = self._sessions.get(provider)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=HTTP_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[provider] = session
+        return session
+
+    @asynccontextmanager
+    async def session(self, provider: str):
+        """Контекстный менеджер для общей сессии: в отличие от ClientSession, не закрывает ее на выходе"""
+        yield self.get(provider)
+
+    async def close(self):
+        """Закрывает все сессии (вызывается при остановке бота)"""
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
+
+
+# Глобальный пул HTTP-сессий
+http_sessions = HttpSessionPool()
@@ -259,6 +259,12 @@ echo "$IMPORT_TEST"
 SUCCESS_COUNT=$(echo "$IMPORT_TEST" | grep "SUCCESS:" | cut -d: -f2)
 ERROR_COUNT=$(echo "$IMPORT_TEST" | grep "ERRORS:" | cut -d: -f2)
 
+# Строим индекс узлов diagrams (иначе бот построит его при первом запросе)
+if echo "$IMPORT_TEST" | grep -q "✅ diagrams"; then
+    echo "🗂️ Построение индекса узлов diagrams..."
+    python node_index.py || echo "⚠️ Индекс узлов не построен, бот построит его при первом запросе"
+fi
+
 echo ""
 echo "📊 Результаты установки:"
 echo "✅ Успешно: $SUCCESS_COUNT пакетов"
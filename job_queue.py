@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from config import JOB_QUEUE, JOB_QUEUE_FILE, JOB_LEASE_TIMEOUT, JOB_POLL_INTERVAL
+from metrics import queue_wait
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue(ABC):
+    """Очередь заданий на генерацию диаграмм между ботом и воркерами.
+
+    Задание — словарь {"user_id", "request", "provider", "model", "use_cache"},
+    результат — словарь из diagram_jobs.execute_job.
+    """
+
+    @abstractmethod
+    async def put(self, job: dict) -> str:
+        """Ставит задание в очередь и возвращает его id"""
+
+    @abstractmethod
+    async def take(self, worker: str, timeout: float) -> Optional[Tuple[str, dict]]:
+        """Забирает следующее задание; None, если за timeout секунд заданий не появилось"""
+
+    @abstractmethod
+    async def complete(self, job_id: str, result: dict):
+        """Сохраняет результат задания"""
+
+    @abstractmethod
+    async def wait_result(self, job_id: str, timeout: float) -> dict:
+        """Ждет результат задания; при таймауте снимает задание и бросает asyncio.TimeoutError"""
+
+    @abstractmethod
+    async def pending_count(self) -> int:
+        """Сколько заданий ждут воркера"""
+
+    async def close(self):
+        pass
+
+
+class MemoryJobQueue(JobQueue):
+    """Очередь в памяти: бот и воркеры работают в одном процессе"""
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._results: Dict[str, asyncio.Future] = {}
+
+    def _get_queue(self) -> asyncio.Queue:
+        # Создаем при первом обращении, уже внутри цикла событий
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def put(self, job: dict) -> str:
+        job_id = uuid.uuid4().hex
+        self._results[job_id] = asyncio.get_running_loop().create_future()
+        self._get_queue().put_nowait((job_id, job, time.monotonic()))
+        return job_id
+
+    async def take(self, worker: str, timeout: float) -> Optional[Tuple[str, dict]]:
+        queue = self._get_queue()
+        while True:
+            try:
+                job_id, job, enqueued_at = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+            # Пропускаем задания, результат которых уже никто не ждет
+            if job_id in self._results:
+                queue_wait.observe(time.monotonic() - enqueued_at, queue="jobs")
+                return job_id, job
+
+    async def complete(self, job_id: str, result: dict):
+        future = self._results.get(job_id)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def wait_result(self, job_id: str, timeout: float) -> dict:
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._results[job_id]), timeout=timeout)
+        finally:
+            self._results.pop(job_id, None)
+
+    async def pending_count(self) -> int:
+        return self._get_queue().qsize()
+
+
+class SQLiteJobQueue(JobQueue):
+    """Очередь в файле SQLite (режим WAL): бот и воркеры — разные процессы.
+
+    Воркер забирает задание в транзакции BEGIN IMMEDIATE, поэтому одно задание
+    не достанется двум воркерам. Задание, которое воркер взял и не завершил
+    за lease_timeout секунд (воркер упал), снова становится доступным.
+    Изображение результата хранится в BLOB-колонке; строка удаляется, когда
+    бот прочитал результат.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_FILE, lease_timeout: float = JOB_LEASE_TIMEOUT,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+        self._conn: Optional[sqlite3.Connection] = None
+        # Один поток: SQLite-соединение используется строго последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job_queue")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # isolation_level=None: транзакциями управляем сами (BEGIN IMMEDIATE)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " result TEXT,"
+                " image BLOB,"
+                " created_at REAL NOT NULL,"
+                " claimed_at REAL,"
+                " worker TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            self._conn = conn
+        return self._conn
+
+    def _put_sync(self, job_id: str, job: dict):
+        self._connect().execute(
+            "INSERT INTO jobs (id, payload, created_at) VALUES (?, ?, ?)",
+            (job_id, json.dumps(job, ensure_ascii=False), time.time())
+        )
+
+    async def put(self, job: dict) -> str:
+        job_id = uuid.uuid4().hex
+        await self._run(self._put_sync, job_id, job)
+        return job_id
+
+    def _claim_sync(self, worker: str) -> Optional[Tuple[str, dict]]:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'pending', claimed_at = NULL, worker = NULL "
+                "WHERE status = 'running' AND claimed_at < ?",
+                (now - self.lease_timeout,)
+            ).rowcount
+            if requeued:
+                logger.warning(f"Возвращено в очередь заданий зависших воркеров: {requeued}")
+            row = conn.execute(
+                "SELECT id, payload, created_at FROM jobs WHERE status = 'pending' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', claimed_at = ?, worker = ? WHERE id = ?",
+                    (now, worker, row[0])
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        # Время в очереди считаем от постановки (для возвращенных заданий — с учетом первой попытки)
+        queue_wait.observe(max(now - row[2], 0), queue="jobs")
+        return row[0], json.loads(row[1])
+
+    async def take(self, worker: str, timeout: float) -> Optional[Tuple[str, dict]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            claimed = await self._run(self._claim_sync, worker)
+            if claimed is not None or time.monotonic() >= deadline:
+                return claimed
+            await asyncio.sleep(self.poll_interval)
+
+    def _complete_sync(self, job_id: str, result: dict):
+        result = dict(result)
+        image = result.pop("image", None)
+        # Детали ошибки API могут содержать произвольные объекты
+        self._connect().execute(
+            "UPDATE jobs SET status = 'done', result = ?, image = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False, default=str), image, job_id)
+        )
+
+    async def complete(self, job_id: str, result: dict):
+        await self._run(self._complete_sync, job_id, result)
+
+    def _pop_result_sync(self, job_id: str) -> Optional[dict]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT result, image FROM jobs WHERE id = ? AND status = 'done'", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        result = json.loads(row[0])
+        if row[1] is not None:
+            result["image"] = bytes(row[1])
+        return result
+
+    def _delete_sync(self, job_id: str):
+        self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    async def wait_result(self, job_id: str, timeout: float) -> dict:
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                result = await self._run(self._pop_result_sync, job_id)
+                if result is not None:
+                    return result
+                if time.monotonic() >= deadline:
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep(self.poll_interval)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # Результат больше никто не ждет: убираем задание, чтобы воркер его не брал
+            await asyncio.shield(self._run(self._delete_sync, job_id))
+            raise
+
+    def _pending_count_sync(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+
+    async def pending_count(self) -> int:
+        return await self._run(self._pending_count_sync)
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        await self._run(self._close_sync)
+
+
+job_queue_backends = {
+    "memory": MemoryJobQueue,
+    "sqlite": SQLiteJobQueue,
+}
+
+
+def create_job_queue(backend: str = JOB_QUEUE) -> Optional[JobQueue]:
+    """Очередь выбранного бэкенда; None — генерировать прямо в процессе бота"""
+    if not backend:
+        return None
+    if backend not in job_queue_backends:
+        raise ValueError(f"Неизвестная очередь заданий: {backend}")
+    return job_queue_backends[backend]()
+
+
+# Глобальная очередь заданий (None, если JOB_QUEUE не задан)
+job_queue = create_job_queue()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Воркер очереди заданий на генерацию диаграмм.
+
+Забирает задания из очереди (JOB_QUEUE=sqlite, файл JOB_QUEUE_FILE), генерирует
+код и рендерит диаграммы, результат возвращает боту через ту же очередь.
+Воркеров можно запустить несколько на той же машине, что и бот: очередь и база
+пользователей — файлы SQLite в режиме WAL, который не работает на сетевых
+файловых системах:
+
+    JOB_QUEUE=sqlite python job_worker.py
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+from typing import Optional
+
+from config import JOB_QUEUE, JOB_WORKER_CONCURRENCY
+from diagram_jobs import execute_job
+from http_session import http_sessions
+from job_queue import JobQueue, job_queue
+from llm_clients import llm_client_factories
+from metrics import start_metrics_server
+from node_index import node_index
+from render_pool import render_pool
+from user_store import user_store
+
+logger = logging.getLogger(__name__)
+
+# Как часто воркер без заданий проверяет, не пора ли остановиться
+TAKE_TIMEOUT = 1.0
+
+
+async def _process(queue: JobQueue, job_id: str, job: dict):
+    try:
+        result = await execute_job(job)
+    except Exception as e:
+        logger.error(f"Задание {job_id} завершилось с ошибкой: {e}")
+        result = {"status": "error", "error": str(e), "error_details": None}
+    await queue.complete(job_id, result)
+
+
+async def run_worker(queue: JobQueue, concurrency: int = JOB_WORKER_CONCURRENCY,
+                     stop: Optional[asyncio.Event] = None, name: Optional[str] = None):
+    """Выполняет задания из очереди, не больше concurrency одновременно, до stop.
+
+    После stop новые задания не берутся, начатые доводятся до конца.
+    """
+    stop = stop or asyncio.Event()
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+    logger.info(f"Воркер {name} запущен, одновременных заданий: {concurrency}")
+    try:
+        while not stop.is_set():
+            await slots.acquire()
+            try:
+                claimed = await queue.take(name, TAKE_TIMEOUT)
+            except Exception as e:
+                slots.release()
+                logger.error(f"Не удалось получить задание из очереди: {e}")
+                await asyncio.sleep(TAKE_TIMEOUT)
+                continue
+            if claimed is None:
+                slots.release()
+                continue
+            job_id, job = claimed
+            task = asyncio.ensure_future(_process(queue, job_id, job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        if running:
+            logger.info(f"Воркер {name}: ожидаю завершения заданий: {len(running)}")
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def main():
+    if JOB_QUEUE != "sqlite":
+        logger.error("Отдельный воркер работает только с JOB_QUEUE=sqlite "
+                     "(очередь в памяти обслуживают воркеры внутри процесса бота)")
+        return
+    await node_index.load()
+    for provider in llm_client_factories:
+        http_sessions.get(provider)
+    await render_pool.start()
+    metrics_runner = await start_metrics_server()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await run_worker(job_queue, stop=stop)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await render_pool.close()
+        await http_sessions.close()
+        await user_store.close()
+        await job_queue.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(main())
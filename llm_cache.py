@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from config import LLM_CACHE_FILE, LLM_CACHE_TTL
+from metrics import count_cache
+
+
+def normalize_request(user_request: str) -> str:
+    """Нормализует текст запроса: регистр, пробелы и завершающая пунктуация не важны"""
+    text = re.sub(r'\s+', ' ', user_request.strip().lower())
+    return text.rstrip(' .!?')
+
+
+class LLMResponseCache:
+    """Кэш кода диаграмм, сгенерированного LLM, с TTL и хранением в SQLite.
+
+    Ключ — (провайдер, модель, нормализованный запрос, версия промпта).
+    Запись переживает перезапуск бота; устаревшие записи удаляются при чтении
+    и при каждой записи.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_FILE, ttl: float = LLM_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                " key TEXT PRIMARY KEY,"
+                " code TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _key(provider: str, model: str, user_request: str, prompt_version: str) -> str:
+        raw = "\x00".join((provider, model, normalize_request(user_request), prompt_version))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _get_sync(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT code, expires_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            return row[0]
+
+    def _put_sync(self, key: str, code: str):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute("DELETE FROM llm_responses WHERE expires_at < ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, code, expires_at) VALUES (?, ?, ?)",
+                (key, code, now + self.ttl)
+            )
+            conn.commit()
+
+    async def get(self, provider: str, model: str, user_request: str, prompt_version: str) -> Optional[str]:
+        """Возвращает закэшированный код диаграммы или None"""
+        if not self.enabled:
+            return None
+        key = self._key(provider, model, user_request, prompt_version)
+        # SQLite блокирующий — работаем с ним вне цикла событий
+        code = await asyncio.get_running_loop().run_in_executor(None, self._get_sync, key)
+        count_cache("llm", code is not None)
+        return code
+
+    async def put(self, provider: str, model: str, user_request: str, prompt_version: str, code: str):
+        """Сохраняет код диаграммы, который успешно отрендерился"""
+        if not self.enabled:
+            return
+        key = self._key(provider, model, user_request, prompt_version)
+        await asyncio.get_running_loop().run_in_executor(None, self._put_sync, key, code)
+
+
+# Глобальный кэш ответов LLM
+llm_response_cache = LLMResponseCache()
@@ -0,0 +1,29 @@
+from typing import Optional
+
+from config import PROXYAPI_KEY
+from base_llm_client import BaseLLMClient
+from gigachat_client import GigaChatClient
+from proxyapi_client import ProxyApiClient
+
+# Фабрики клиентов LLM. На каждый запрос создается свой экземпляр клиента,
+# чтобы ключ, модель и диагностика одного пользователя не перетирали чужие.
+# Токены и соединения при этом общие (см. token_cache).
+llm_client_factories = {
+    "gigachat": GigaChatClient,
+    "proxyapi": lambda: ProxyApiClient(api_key=PROXYAPI_KEY),
+    # "openai": OpenAIClient,  # пример для будущего расширения
+}
+
+
+def create_llm_client(provider: str, api_key: str, model: Optional[str] = None) -> BaseLLMClient:
+    """Создает клиент провайдера с ключом и (если задана) моделью пользователя"""
+    llm_client = llm_client_factories[provider]()
+    llm_client.set_credentials(api_key)
+    if model:
+        llm_client.set_model(model)
+    return llm_client
+
+
+def clone_llm_client(llm_client: BaseLLMClient) -> BaseLLMClient:
+    """Отдельный клиент того же провайдера с теми же ключом и моделью (для параллельных запросов)"""
+    return create_llm_client(llm_client.provider, llm_client.get_credentials(), llm_client.get_current_model())
@@ -1,19 +1,33 @@
 import asyncio
 import logging
 import os
-import json
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile
-
-from config import BOT_TOKEN, PROXYAPI_KEY
-from gigachat_client import gigachat_client, GigaChatClient
-from diagram_generator import diagram_generator, generate_diagram_with_retries
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config import BOT_TOKEN, BOT_MODE, WEBHOOK_SECRET, TELEGRAM_API_URL, RENDER_MAX_QUEUE, JOB_QUEUE, JOB_RESULT_TIMEOUT, FSM_STORAGE
+from diagram_generator import diagram_generator
+from diagram_jobs import run_diagram_request, DiagramJobError
+from fsm_storage import SQLiteStorage
 from base_llm_client import BaseLLMClient
-from proxyapi_client import ProxyApiClient
+from llm_clients import llm_client_factories, create_llm_client
+from http_session import http_sessions
+from job_queue import job_queue
+from job_worker import run_worker
+from metrics import start_metrics_server
+from render_pool import render_pool
+from render_scheduler import render_scheduler, QueueFullError
+from model_catalog import model_catalog
+from node_index import node_index
+from telegram_file_cache import telegram_file_cache, image_hash
+from user_store import user_store
+from webhook import run_webhook
 
 
 # Настройка логирования
@@ -24,25 +38,27 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+)
+dp = Dispatcher(storage=SQLiteStorage() if FSM_STORAGE == "sqlite" else MemoryStorage())
 
-USER_DATA_FILE = "user_data.json"
 
-def load_user_data():
-    try:
-        with open(USER_DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return data.get("api_keys", {}), data.get("models", {})
-    except Exception:
-        return {}, {}
+async def get_user_settings(user_id: int) -> dict:
+    """Настройки пользователя из user_store на момент запроса.
 
-def save_user_data():
-    with open(USER_DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump({"api_keys": user_api_keys, "models": user_models}, f)
-
-# Загрузка при старте
-user_api_keys, user_models = load_user_data()
+    Читаются при каждом обращении (с коротким кэшем в user_store), поэтому
+    несколько процессов бота с общей базой видят изменения друг друга.
+    no_cache — пользователь отключил кэш ответов LLM (/nocache).
+    """
+    user = await user_store.get(user_id) or {}
+    return {
+        "api_key": user.get("api_key"),
+        "model": user.get("model"),
+        "llm_provider": user.get("llm_provider") or "gigachat",
+        "no_cache": bool(user.get("no_cache")),
+    }
 
 # Состояния для FSM
 class UserStates(StatesGroup):
@@ -51,17 +67,13 @@ class UserStates(StatesGroup):
     selecting_model = State()
 
 
-# Хранилище выбранных моделей пользователей
-user_models = {}
-
-# Словарь клиентов LLM
-llm_clients = {
-    "gigachat": GigaChatClient(),
-    "proxyapi": ProxyApiClient(api_key=PROXYAPI_KEY),
-    # "openai": OpenAIClient(),  # пример для будущего расширения
-}
-# Хранилище выбранных провайдеров пользователями
-user_llm_provider = {}  # user_id: "gigachat" / "openai" / ...
+def get_llm_client(settings: dict, api_key=None) -> BaseLLMClient:
+    """Создает клиент LLM для одного запроса пользователя с его ключом и моделью"""
+    return create_llm_client(
+        settings["llm_provider"],
+        api_key if api_key is not None else settings["api_key"],
+        settings["model"]
+    )
 
 
 def get_main_keyboard():
@@ -156,7 +168,7 @@ def get_default_model(provider):
 async def start_command(message: types.Message):
     """Обработчик команды /start"""
     user_id = message.from_user.id
-    provider = user_llm_provider.get(user_id, "gigachat")
+    provider = (await get_user_settings(user_id))["llm_provider"]
     provider_name = get_provider_name(provider)
     welcome_text = f"""
 🚀 **Добро пожаловать в Diagram Generator Bot!**
@@ -187,7 +199,7 @@ async def start_command(message: types.Message):
 async def set_api_key_callback(callback: types.CallbackQuery, state: FSMContext):
     """Обработчик установки API ключа"""
     user_id = callback.from_user.id
-    provider = user_llm_provider.get(user_id, "gigachat")
+    provider = (await get_user_settings(user_id))["llm_provider"]
     if provider == "proxyapi":
         provider_name = "ProxyAPI"
     else:
@@ -207,7 +219,7 @@ async def create_diagram_callback(callback: types.CallbackQuery, state: FSMConte
     """Обработчик создания диаграммы"""
     user_id = callback.from_user.id
     
-    if user_id not in user_api_keys:
+    if not (await get_user_settings(user_id))["api_key"]:
         await callback.message.edit_text(
             "❌ **API ключ не установлен**\n\n"
             "Для создания диаграмм необходимо установить API ключ Гигачата.\n"
@@ -236,8 +248,9 @@ async def create_diagram_callback(callback: types.CallbackQuery, state: FSMConte
 async def select_model_callback(callback: types.CallbackQuery, state: FSMContext):
     """Обработчик выбора модели"""
     user_id = callback.from_user.id
-    provider = user_llm_provider.get(user_id, "gigachat")
-    if user_id not in user_api_keys:
+    settings = await get_user_settings(user_id)
+    provider = settings["llm_provider"]
+    if not settings["api_key"]:
         await callback.message.edit_text(
             "❌ **API ключ не установлен**\n\n"
             f"Для выбора модели необходимо установить API ключ выбранного провайдера ({provider}).\n"
@@ -246,11 +259,10 @@ async def select_model_callback(callback: types.CallbackQuery, state: FSMContext
             parse_mode="Markdown"
         )
         return
-    llm_client = llm_clients[provider]
-    llm_client.set_credentials(user_api_keys[user_id])
+    llm_client = get_llm_client(settings)
     status_message = await callback.message.edit_text("🔄 Получаю список доступных моделей...")
     try:
-        models = await llm_client.get_available_models()
+        models = await model_catalog.get(provider, llm_client)
         current_model = llm_client.get_current_model()
         if models:
             model_buttons = []
@@ -317,12 +329,8 @@ async def model_selected_callback(callback: types.CallbackQuery):
     model_id = callback.data.replace("model_", "")
     user_id = callback.from_user.id
     
-    if user_id in user_api_keys:
-        llm_client = llm_clients[user_llm_provider.get(user_id, "gigachat")]
-        llm_client.set_credentials(user_api_keys[user_id])
-        llm_client.set_model(model_id)
-        user_models[user_id] = model_id
-        save_user_data()
+    if (await get_user_settings(user_id))["api_key"]:
+        await user_store.set_model(user_id, model_id)
         
         await callback.message.edit_text(
             f"✅ **Модель выбрана!**\n\n"
@@ -361,6 +369,7 @@ async def help_callback(callback: types.CallbackQuery):
 **Основные команды:**
 • /start - Главное меню
 • /cancel - Отмена текущего действия
+• /nocache - Включить/выключить кэш сгенерированного кода
 
 **Как работает бот:**
 1. **Установка API ключа** — вы предоставляете ключ выбранного провайдера
@@ -395,7 +404,8 @@ async def process_api_key(message: types.Message, state: FSMContext):
     """Обработчик ввода API ключа"""
     api_key = message.text.strip()
     user_id = message.from_user.id
-    provider = user_llm_provider.get(user_id, "gigachat")
+    settings = await get_user_settings(user_id)
+    provider = settings["llm_provider"]
     # Удаляем сообщение с API ключом из соображений безопасности
     try:
         await message.delete()
@@ -407,13 +417,11 @@ async def process_api_key(message: types.Message, state: FSMContext):
     else:
         provider_name = "Гигачата"
     status_message = await message.answer(f"🔄 Проверяю API ключ {provider_name}...")
+    llm_client = get_llm_client(settings, api_key)
     try:
-        llm_client = llm_clients[provider]
-        llm_client.set_credentials(api_key)
         is_valid, error_message = await llm_client.check_credentials()
         if is_valid:
-            user_api_keys[user_id] = api_key
-            save_user_data()
+            await user_store.set_api_key(user_id, api_key)
             await status_message.edit_text(
                 f"✅ **API ключ {provider_name} успешно установлен!**\n\n"
                 "Теперь вы можете создавать диаграммы.\n"
@@ -493,13 +501,54 @@ async def process_api_key(message: types.Message, state: FSMContext):
     await state.clear()
 
 
+async def send_diagram_photo(message: types.Message, diagram_path: str, caption: str):
+    """Отправляет диаграмму, по возможности повторно используя file_id уже загруженной картинки"""
+    photo_key = image_hash(diagram_path)
+    file_id = await telegram_file_cache.get(photo_key)
+    if file_id:
+        try:
+            return await message.answer_photo(file_id, caption=caption, parse_mode="Markdown")
+        except TelegramBadRequest as e:
+            # file_id устарел или недействителен — загружаем файл заново
+            logger.warning(f"Не удалось отправить диаграмму по file_id: {e}")
+            await telegram_file_cache.invalidate(photo_key)
+    sent_message = await message.answer_photo(FSInputFile(diagram_path), caption=caption, parse_mode="Markdown")
+    if sent_message.photo:
+        # Самый большой размер — последний в списке
+        await telegram_file_cache.put(photo_key, sent_message.photo[-1].file_id)
+    return sent_message
+
+
+async def run_queued_request(user_id: int, settings: dict, request_text: str):
+    """Ставит генерацию в очередь заданий и ждет результат воркера: (путь, код, ошибка)"""
+    job_id = await job_queue.put({
+        "user_id": user_id,
+        "request": request_text,
+        "provider": settings["llm_provider"],
+        "model": settings["model"],
+        "use_cache": not settings["no_cache"],
+    })
+    try:
+        result = await job_queue.wait_result(job_id, JOB_RESULT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise DiagramJobError(f"Диаграмма не создана за {JOB_RESULT_TIMEOUT} секунд")
+    if result["status"] == "error":
+        raise DiagramJobError(result["error"], result.get("error_details"))
+    if result["status"] == "failed":
+        return None, result["code"], result["error"]
+    # Воркер — отдельный процесс со своими каталогами: сохраняем изображение у себя
+    diagram_path = diagram_generator.store_image(result["code"], result["image"], result["suffix"], user_id)
+    return diagram_path, result["code"], None
+
+
 @dp.message(StateFilter(UserStates.waiting_diagram_request))
 async def process_diagram_request(message: types.Message, state: FSMContext):
     """Обработчик запроса на создание диаграммы"""
     user_id = message.from_user.id
     request_text = message.text.strip()
+    settings = await get_user_settings(user_id)
     
-    if user_id not in user_api_keys:
+    if not settings["api_key"]:
         await message.answer(
             "❌ API ключ не найден. Установите ключ заново.",
             reply_markup=get_main_keyboard()
@@ -507,45 +556,78 @@ async def process_diagram_request(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Устанавливаем API ключ для текущего запроса
-    llm_client = llm_clients[user_llm_provider.get(user_id, "gigachat")]
-    llm_client.set_credentials(user_api_keys[user_id])
+    # Отдельный клиент с ключом и моделью пользователя для текущего запроса
+    llm_client = get_llm_client(settings)
+    use_cache = not settings["no_cache"]
     
     status_message = await message.answer("🤖 Генерирую код диаграммы...")
     
+    async def show_queue_position(position):
+        await status_message.edit_text(
+            f"⏳ Ваш запрос в очереди: {position}\n\n"
+            "Диаграмма начнет создаваться, как только освободится место."
+        )
+    
+    async def show_overloaded():
+        await status_message.edit_text(
+            "❌ **Сервис перегружен**\n\n"
+            "Сейчас слишком много запросов на создание диаграмм. Попробуйте через пару минут.",
+            reply_markup=get_main_keyboard(),
+            parse_mode="Markdown"
+        )
+        await state.clear()
+    
+    waited = False
+    if job_queue is not None:
+        # Генерацию выполняют воркеры очереди, бот только ждет результат
+        if await job_queue.pending_count() >= RENDER_MAX_QUEUE:
+            await show_overloaded()
+            return
+    else:
+        # Ограничиваем число одновременных генераций, очередь общая для всех пользователей
+        try:
+            waited = await render_scheduler.acquire(user_id, show_queue_position)
+        except QueueFullError:
+            await show_overloaded()
+            return
+    
+    # Слот занят: все, что дальше, внутри try, чтобы finally его освободил
     try:
-        # Генерируем код диаграммы
-        diagram_code = await llm_client.generate_diagram_code(request_text)
-        await status_message.edit_text("🔨 Создаю диаграмму...")
-        
-        # Генерируем диаграмму с повторными попытками
-        result = await generate_diagram_with_retries(diagram_code, user_id, llm_client, max_attempts=3)
-        if isinstance(result, str):
-            diagram_path = result
+        if waited:
+            await status_message.edit_text("🤖 Генерирую код диаграммы...")
+        if job_queue is not None:
+            diagram_path, diagram_code, last_error = await run_queued_request(user_id, settings, request_text)
         else:
-            diagram_path, last_code, last_error = result if isinstance(result, tuple) and len(result) == 3 else (None, None, None)
+            async def show_generation_progress(content):
+                try:
+                    await status_message.edit_text(
+                        f"🤖 Генерирую код диаграммы... (получено строк: {content.count(chr(10)) + 1})"
+                    )
+                except TelegramBadRequest:
+                    pass
+            
+            async def show_render_start():
+                await status_message.edit_text("🔨 Создаю диаграмму...")
+            
+            diagram_path, diagram_code, last_error = await run_diagram_request(
+                llm_client, request_text, user_id, use_cache,
+                on_generation_progress=show_generation_progress,
+                on_render_start=show_render_start
+            )
         # Отправляем диаграмму пользователю
         if diagram_path and os.path.exists(diagram_path):
             await status_message.edit_text("📤 Отправляю диаграмму...")
-            diagram_file = FSInputFile(diagram_path)
-            await message.answer_photo(
-                diagram_file,
-                caption=f"📊 **Диаграмма готова!**\n\n**Запрос:** {request_text}",
-                parse_mode="Markdown"
+            await send_diagram_photo(
+                message,
+                diagram_path,
+                caption=f"📊 **Диаграмма готова!**\n\n**Запрос:** {request_text}"
             )
             # Отправляем исходный скрипт отдельным сообщением
             await message.answer(
                 f"**Исходный скрипт диаграммы:**\n```python\n{diagram_code}\n```",
                 parse_mode="Markdown"
             )
-            # Удаляем временный файл (если он в temp)
-            try:
-                if os.path.dirname(diagram_path) == os.path.abspath(DIAGRAMS_DIR):
-                    pass  # не удаляем из diagrams
-                else:
-                    os.remove(diagram_path)
-            except:
-                pass
+            # Файл не удаляем: он лежит в кэше изображений и пригодится для повторных запросов
             await status_message.delete()
             # Предлагаем создать еще одну диаграмму
             await message.answer(
@@ -554,10 +636,10 @@ async def process_diagram_request(message: types.Message, state: FSMContext):
                 reply_markup=get_main_keyboard(),
                 parse_mode="Markdown"
             )
-        elif last_code and last_error:
+        elif diagram_code and last_error:
             # Не удалось получить рабочий скрипт за 3 попытки
             # Отправляем пользователю итоговый скрипт и текст ошибки
-            code_block = f'<pre language="python">{last_code}</pre>'
+            code_block = f'<pre language="python">{diagram_code}</pre>'
             error_block = f'<b>Ошибка:</b> {last_error}'
             await status_message.edit_text(
                 "❌ <b>Не удалось создать рабочий скрипт для диаграммы за 3 попытки.</b>\n\n"
@@ -576,8 +658,11 @@ async def process_diagram_request(message: types.Message, state: FSMContext):
     except Exception as e:
         logger.error(f"Ошибка создания диаграммы: {e}")
         
-        # Получаем детали ошибки для диагностики
-        error_details = llm_client.get_last_error_details()
+        # Получаем детали ошибки для диагностики (из воркера, если генерация шла через очередь)
+        if isinstance(e, DiagramJobError):
+            error_details = e.error_details
+        else:
+            error_details = llm_client.get_last_error_details()
         
         error_text = f"❌ **Ошибка создания диаграммы**\n\n"
         error_text += f"**Ошибка:** {str(e)}\n\n"
@@ -621,10 +706,26 @@ async def process_diagram_request(message: types.Message, state: FSMContext):
                 reply_markup=get_main_keyboard(),
                 parse_mode="Markdown"
             )
+    finally:
+        if job_queue is None:
+            render_scheduler.release()
     
     await state.clear()
 
 
+@dp.message(Command("nocache"))
+async def nocache_command(message: types.Message):
+    """Включает/выключает кэш ответов LLM для пользователя"""
+    user_id = message.from_user.id
+    no_cache = not (await get_user_settings(user_id))["no_cache"]
+    if no_cache:
+        text = "✅ Кэш отключен: код каждой диаграммы будет заново генерироваться LLM."
+    else:
+        text = "✅ Кэш включен: на повторные запросы бот ответит быстрее, используя уже проверенный код."
+    await user_store.set_no_cache(user_id, no_cache)
+    await message.answer(text, reply_markup=get_main_keyboard())
+
+
 @dp.message(Command("cancel"))
 async def cancel_command(message: types.Message, state: FSMContext):
     """Обработчик команды отмены"""
@@ -648,7 +749,7 @@ async def unknown_message(message: types.Message):
 @dp.callback_query(F.data == "select_llm_provider")
 async def select_llm_provider_callback(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
-    current_provider = user_llm_provider.get(user_id, "gigachat")
+    current_provider = (await get_user_settings(user_id))["llm_provider"]
     buttons = [
         [InlineKeyboardButton(text=("✅ " if current_provider=="gigachat" else "")+"GigaChat", callback_data="llmprov_gigachat")],
         [InlineKeyboardButton(text=("✅ " if current_provider=="proxyapi" else "")+"ProxyAPI (OpenAI)", callback_data="llmprov_proxyapi")],
@@ -666,7 +767,11 @@ async def select_llm_provider_callback(callback: types.CallbackQuery, state: FSM
 async def llm_provider_selected_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     provider = callback.data.replace("llmprov_", "")
-    user_llm_provider[user_id] = provider
+    settings = await get_user_settings(user_id)
+    await user_store.set_llm_provider(user_id, provider)
+    # Модель другого провайдера не подходит — возвращаемся к модели по умолчанию
+    if settings["model"] is not None:
+        await user_store.set_model(user_id, None)
     await callback.message.edit_text(
         f"✅ Провайдер LLM выбран: <b>{provider}</b>\n\nТеперь генерация диаграмм будет выполняться через выбранного провайдера.",
         reply_markup=get_main_keyboard(),
@@ -682,13 +787,48 @@ async def main():
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN не установлен в переменных окружения")
         return
+    # Без секрета любой, кто знает адрес вебхука, может слать боту поддельные обновления
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        logger.error("WEBHOOK_SECRET не установлен: в режиме вебхука он обязателен")
+        return
+    
+    # Индекс узлов diagrams нужен проверкам кода; строим его вне цикла событий
+    await node_index.load()
+    
+    # Открываем общие HTTP-сессии провайдеров заранее
+    for provider in llm_client_factories:
+        http_sessions.get(provider)
+    # Прогреваем воркеры рендеринга до первых запросов
+    await render_pool.start()
+    # Списки моделей обновляются в фоне, меню выбора модели отвечает из памяти
+    model_catalog.start()
+    metrics_runner = await start_metrics_server()
+    # Очередь в памяти обслуживают воркеры внутри процесса бота
+    workers_stop = asyncio.Event()
+    workers = asyncio.ensure_future(run_worker(job_queue, stop=workers_stop)) if JOB_QUEUE == "memory" else None
     
     try:
         # Запускаем бота
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Long polling не работает, пока у бота зарегистрирован вебхук
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка запуска бота: {e}")
     finally:
+        if workers is not None:
+            workers_stop.set()
+            await workers
+        await model_catalog.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await render_pool.close()
+        await http_sessions.close()
+        await user_store.close()
+        if job_queue is not None:
+            await job_queue.close()
         await bot.session.close()
 
 
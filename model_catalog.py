@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from config import MODEL_CATALOG_FILE, MODEL_CATALOG_TTL, MODEL_CATALOG_REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class ModelCatalog:
+    """Кэш списков моделей по провайдерам.
+
+    Меню выбора модели берет список из памяти без обращения к API. Если список
+    старше ttl, он все равно отдается сразу, а обновление запускается в фоне
+    (stale-while-revalidate). Кроме того, списки периодически обновляются
+    фоновой задачей. Последний удачный список сохраняется на диск и после
+    перезапуска доступен сразу. Список по умолчанию (API недоступен) не
+    заменяет уже известный удачный список и не сохраняется.
+    """
+
+    def __init__(self, path: str = MODEL_CATALOG_FILE, ttl: float = MODEL_CATALOG_TTL,
+                 refresh_interval: float = MODEL_CATALOG_REFRESH_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self._entries: Dict[str, dict] = self._load()
+        # Последний клиент провайдера с рабочим ключом — им обновляем список в фоне
+        self._clients: Dict[str, object] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Dict[str, dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать кэш моделей {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить кэш моделей {self.path}: {e}")
+
+    async def refresh(self, provider: str, client=None) -> List[dict]:
+        """Запрашивает список моделей у провайдера и обновляет кэш"""
+        client = client or self._clients.get(provider)
+        if client is None:
+            raise ValueError(f"Нет клиента для обновления моделей {provider}")
+        lock = self._locks.setdefault(provider, asyncio.Lock())
+        async with lock:
+            models = await client.get_available_models()
+            if models and models != client.default_models:
+                self._entries[provider] = {"models": models, "fetched_at": time.time()}
+                self._save()
+            elif provider in self._entries:
+                # API вернул список по умолчанию — остаемся на последнем удачном
+                return self._entries[provider]["models"]
+            return models
+
+    def _refresh_in_background(self, provider: str):
+        task = self._refreshing.get(provider)
+        if task is not None and not task.done():
+            return
+        self._refreshing[provider] = asyncio.ensure_future(self._safe_refresh(provider))
+
+    async def _safe_refresh(self, provider: str):
+        try:
+            await self.refresh(provider)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить список моделей {provider}: {e}")
+
+    async def get(self, provider: str, client) -> List[dict]:
+        """Список моделей провайдера: из кэша сразу, с первого раза — запросом к API"""
+        self._clients[provider] = client
+        entry = self._entries.get(provider)
+        if entry is None:
+            return await self.refresh(provider, client)
+        if time.time() - entry["fetched_at"] > self.ttl:
+            self._refresh_in_background(provider)
+        return entry["models"]
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            for provider in list(self._clients):
+                await self._safe_refresh(provider)
+
+    def start(self):
+        """Запускает периодическое обновление списков"""
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.ensure_future(self._refresh_loop())
+
+    async def close(self):
+        tasks = [task for task in [self._task, *self._refreshing.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._refreshing.clear()
+
+
+# Глобальный каталог моделей
+model_catalog = ModelCatalog()
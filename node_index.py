@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Индекс реально существующих модулей и классов библиотеки diagrams.
+
+Строится один раз из установленного пакета (импортом всех модулей diagrams.*)
+и сохраняется в NODE_INDEX_FILE. Бот загружает его при старте в отдельном
+потоке (node_index.load()) и перестраивает, если версия diagrams изменилась.
+Заранее построить индекс:
+
+    python node_index.py
+"""
+
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import NODE_INDEX_FILE
+
+logger = logging.getLogger(__name__)
+
+# Что разрешено брать из самого пакета diagrams (остальное в нем — служебное)
+DIAGRAMS_CORE_CLASSES = frozenset({"Diagram", "Cluster", "Edge", "Node", "Group"})
+
+
+def _installed_version() -> Optional[str]:
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:  # Python < 3.8
+        return None
+    try:
+        return version("diagrams")
+    except PackageNotFoundError:
+        return None
+
+
+def build_index() -> dict:
+    """Импортирует все модули diagrams и собирает их публичные классы"""
+    import importlib
+    import inspect
+    import pkgutil
+    import diagrams
+
+    modules: Dict[str, List[str]] = {
+        "diagrams": sorted(
+            name for name, value in vars(diagrams).items()
+            if not name.startswith('_') and inspect.isclass(value)
+        )
+    }
+    nodes: Dict[str, list] = {}
+    for module_info in pkgutil.walk_packages(diagrams.__path__, 'diagrams.'):
+        try:
+            module = importlib.import_module(module_info.name)
+        except Exception as e:
+            logger.warning(f"Не удалось импортировать {module_info.name}: {e}")
+            continue
+        # Классы узлов и их псевдонимы (например, PostgreSQL = Postgresql)
+        names = sorted(
+            name for name, value in vars(module).items()
+            if not name.startswith('_') and inspect.isclass(value) and issubclass(value, diagrams.Node)
+        )
+        modules[module_info.name] = names
+        for name in names:
+            cls = getattr(module, name)
+            # Иконки обычных узлов (без своего __init__, как у Custom) — для рендера без выполнения кода
+            if cls._icon and cls.__init__ is diagrams.Node.__init__:
+                nodes[f"{module_info.name}.{name}"] = [f"{cls._icon_dir}/{cls._icon}", cls._height]
+    return {"version": _installed_version(), "modules": modules, "nodes": nodes}
+
+
+class NodeIndex:
+    """Доступ к индексу узлов diagrams.
+
+    Чтение и построение индекса — синхронные и небыстрые (импорт всех модулей
+    diagrams), поэтому в асинхронном коде индекс загружают заранее через load().
+    """
+
+    def __init__(self, path: str = NODE_INDEX_FILE):
+        self.path = path
+        self._modules: Optional[Dict[str, Set[str]]] = None
+        self._nodes: Dict[str, list] = {}
+        self._resources_base: Optional[str] = None
+        self._by_lower_name: Dict[str, List[str]] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    async def load(self):
+        """Загружает (при необходимости строит) индекс в потоке, не блокируя цикл событий"""
+        if not self._loaded:
+            await asyncio.get_running_loop().run_in_executor(None, self._load)
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._read_or_build()
+                self._loaded = True
+
+    def _read_or_build(self):
+        data = None
+        installed = _installed_version()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать индекс узлов {self.path}: {e}")
+            if data and installed and (data.get("version") != installed or "nodes" not in data):
+                # Индекс от другой версии diagrams или старого формата
+                data = None
+        if data is None:
+            try:
+                data = build_index()
+            except ImportError:
+                logger.warning("diagrams не установлен, индекс узлов недоступен")
+                return
+            try:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=1)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить индекс узлов {self.path}: {e}")
+        self._modules = {module: set(names) for module, names in data["modules"].items()}
+        self._nodes = data.get("nodes", {})
+        for module, names in self._modules.items():
+            for name in names:
+                self._by_lower_name.setdefault(name.lower(), []).append(module)
+
+    @property
+    def available(self) -> bool:
+        self._load()
+        return self._modules is not None
+
+    def has_module(self, module: str) -> bool:
+        self._load()
+        return self._modules is not None and module in self._modules
+
+    def module_classes(self, module: str) -> Set[str]:
+        self._load()
+        return self._modules.get(module, set()) if self._modules else set()
+
+    def has_class(self, module: str, name: str) -> bool:
+        return name in self.module_classes(module)
+
+    def find_class(self, name: str) -> List[str]:
+        """Модули, где есть класс с таким именем без учета регистра"""
+        self._load()
+        return sorted(self._by_lower_name.get(name.lower(), []))
+
+    def class_name(self, module: str, name: str) -> Optional[str]:
+        """Правильное написание имени класса в модуле (PostgreSQL -> Postgresql и т.п.)"""
+        if self.has_class(module, name):
+            return name
+        for candidate in self.module_classes(module):
+            if candidate.lower() == name.lower():
+                return candidate
+        return None
+
+    def resolve(self, path: str) -> Optional[str]:
+        """Что обозначает полное имя diagrams.x.Y: "module", "class" или None (нет в индексе)"""
+        if self.has_module(path):
+            return "module"
+        module, _, name = path.rpartition(".")
+        if module == "diagrams":
+            return "class" if name in DIAGRAMS_CORE_CLASSES else None
+        return "class" if self.has_class(module, name) else None
+
+    def invalid_attribute(self, module: str, attrs: Iterable[str]) -> Optional[str]:
+        """Первое имя в цепочке module.a.b..., которого нет в индексе (None — цепочка допустима).
+
+        После класса цепочка дальше не проверяется.
+        """
+        path = module
+        for attr in attrs:
+            path = f"{path}.{attr}"
+            kind = self.resolve(path)
+            if kind is None:
+                return path
+            if kind == "class":
+                return None
+        return None
+
+    def node_info(self, module: str, name: str) -> Optional[Tuple[str, float]]:
+        """(абсолютный путь к иконке, высота узла) для обычного класса узла или None"""
+        self._load()
+        info = self._nodes.get(f"{module}.{name}")
+        if info is None:
+            return None
+        if self._resources_base is None:
+            # Иконки лежат рядом с пакетом diagrams (site-packages/resources/...)
+            spec = importlib.util.find_spec("diagrams")
+            if spec is None or not spec.origin:
+                return None
+            self._resources_base = os.path.dirname(os.path.dirname(spec.origin))
+        icon, height = info
+        return os.path.join(self._resources_base, icon), height
+
+
+# Глобальный индекс узлов diagrams
+node_index = NodeIndex()
+
+
+if __name__ == "__main__":
+    index = build_index()
+    with open(NODE_INDEX_FILE, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    total = sum(len(names) for names in index["modules"].values())
+    print(f"✅ Индекс узлов diagrams {index['version']} сохранен в {NODE_INDEX_FILE}: "
+          f"{len(index['modules'])} модулей, {total} классов")
@@ -0,0 +1,148 @@
+import ast
+from typing import Dict, List, Set
+
+from node_index import node_index, DIAGRAMS_CORE_CLASSES
+
+# Методы узлов, кластеров и диаграмм diagrams, которые можно вызывать из кода
+# (render вызывается сам при выходе из with Diagram и запрещен валидатором)
+KNOWN_DIAGRAMS_METHODS = {"connect"}
+
+
+class _DiagramsUsage(ast.NodeVisitor):
+    """Собирает импорты diagrams, переменные с объектами diagrams и вызовы их методов"""
+
+    def __init__(self):
+        self.problems: List[str] = []
+        self.imported: Dict[str, str] = {}  # локальное имя -> полное имя (diagrams.Diagram, diagrams.aws.compute.EC2)
+        self.modules: Dict[str, str] = {}  # локальное имя -> модуль diagrams (import diagrams.aws as aws)
+        self.objects: Set[str] = set()  # переменные, в которых лежат узлы/кластеры/диаграммы
+        self.diagram_calls: List[ast.Call] = []
+
+    def _check_import(self, module: str, name: str, lineno: int):
+        if not node_index.available:
+            return
+        if not node_index.has_module(module):
+            self.problems.append(f"строка {lineno}: модуля {module} не существует")
+        elif name != '*' and node_index.resolve(f"{module}.{name}") is None:
+            if module == "diagrams":
+                allowed = ", ".join(sorted(DIAGRAMS_CORE_CLASSES))
+                self.problems.append(f"строка {lineno}: из diagrams можно импортировать только {allowed}, а не {name}")
+                return
+            hint = node_index.class_name(module, name)
+            message = f"строка {lineno}: в модуле {module} нет класса {name}"
+            if hint:
+                message += f" (правильно: {hint})"
+            else:
+                modules = node_index.find_class(name)
+                if modules:
+                    message += f" (он есть в {', '.join(modules[:3])})"
+            self.problems.append(message)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        module = node.module or ""
+        if module == "diagrams" or module.startswith("diagrams."):
+            for alias in node.names:
+                self._check_import(module, alias.name, node.lineno)
+                if node_index.has_module(f"{module}.{alias.name}"):
+                    self.modules[alias.asname or alias.name] = f"{module}.{alias.name}"
+                else:
+                    self.imported[alias.asname or alias.name] = f"{module}.{alias.name}"
+        self.generic_visit(node)
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            if alias.name.startswith("diagrams.") and node_index.available and not node_index.has_module(alias.name):
+                self.problems.append(f"строка {node.lineno}: модуля {alias.name} не существует")
+            elif alias.name == "diagrams" or alias.name.startswith("diagrams."):
+                if alias.asname:
+                    self.modules[alias.asname] = alias.name
+                else:
+                    self.modules["diagrams"] = "diagrams"
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        attrs = []
+        base = node
+        while isinstance(base, ast.Attribute):
+            attrs.append(base.attr)
+            base = base.value
+        if isinstance(base, ast.Name) and base.id in self.modules and node_index.available:
+            invalid = node_index.invalid_attribute(self.modules[base.id], reversed(attrs))
+            if invalid:
+                self.problems.append(f"строка {node.lineno}: в diagrams нет класса или модуля {invalid}")
+            # Вложенные части той же цепочки уже проверены
+            return
+        self.generic_visit(node)
+
+    def _is_diagrams_call(self, value) -> bool:
+        return (
+            isinstance(value, ast.Call)
+            and isinstance(value.func, ast.Name)
+            and value.func.id in self.imported
+        )
+
+    def visit_Assign(self, node: ast.Assign):
+        if self._is_diagrams_call(node.value):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    self.objects.add(target.id)
+        self.generic_visit(node)
+
+    def visit_With(self, node: ast.With):
+        for item in node.items:
+            if self._is_diagrams_call(item.context_expr) and isinstance(item.optional_vars, ast.Name):
+                self.objects.add(item.optional_vars.id)
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        if (
+            isinstance(node.func, ast.Name) and self.imported.get(node.func.id) == "diagrams.Diagram"
+            or isinstance(node.func, ast.Attribute) and node.func.attr == "Diagram"
+        ):
+            self.diagram_calls.append(node)
+        if (
+            isinstance(node.func, ast.Attribute)
+            and isinstance(node.func.value, ast.Name)
+            and node.func.value.id in self.objects
+            and node.func.attr not in KNOWN_DIAGRAMS_METHODS
+        ):
+            self.problems.append(
+                f"строка {node.lineno}: у объектов diagrams нет метода {node.func.attr} "
+                f"({node.func.value.id}.{node.func.attr}); связи задаются операторами >>, << и -"
+            )
+        self.generic_visit(node)
+
+
+def _has_show_false(call: ast.Call) -> bool:
+    return any(
+        keyword.arg == "show" and isinstance(keyword.value, ast.Constant) and keyword.value.value is False
+        for keyword in call.keywords
+    )
+
+
+def preflight_check(code: str) -> List[str]:
+    """Статически проверяет код диаграммы до запуска рендера.
+
+    Возвращает список найденных проблем (пустой — можно рендерить): синтаксис,
+    импорты из несуществующих модулей и классов diagrams, вызовы несуществующих
+    методов у узлов и наличие Diagram(..., show=False).
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return [f"строка {e.lineno}: синтаксическая ошибка: {e.msg}"]
+
+    usage = _DiagramsUsage()
+    usage.visit(tree)
+    problems = usage.problems
+    if not usage.diagram_calls:
+        problems.append("нет вызова Diagram(...) из diagrams: код должен создавать диаграмму в блоке with Diagram(..., show=False)")
+    for call in usage.diagram_calls:
+        if not _has_show_false(call):
+            problems.append(f"строка {call.lineno}: у Diagram(...) должен быть параметр show=False")
+    return problems
+
+
+def format_problems(problems: List[str]) -> str:
+    """Текст ошибки для пользователя и для fix_code"""
+    return "Статическая проверка кода нашла ошибки:\n" + "\n".join(f"- {problem}" for problem in problems)
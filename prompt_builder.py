@@ -0,0 +1,175 @@
+import re
+from typing import Dict, List, Set, Tuple
+
+from config import GIGACHAT_SYSTEM_PROMPT, PROMPT_MODE, PROMPT_MAX_CHARS
+from node_index import node_index
+
+CATALOG_MARKER = "Перечень пространств имён diagrams"
+EXAMPLES_MARKER = "Примеры генерации диаграмм:"
+RULES_MARKER = "Не используй методы, которых нет в diagrams"
+
+# Ключевые слова запроса, по которым выбираются разделы каталога
+SECTION_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "aws": ("aws", "amazon", "амазон", "ec2", "s3", "lambda", "лямбд", "dynamodb", "rds", "cloudfront",
+            "route53", "sqs", "sns", "eks", "ecs", "redshift", "kinesis", "fargate"),
+    "azure": ("azure", "азур", "ажур", "microsoft", "майкрософт", "cosmos"),
+    "gcp": ("gcp", "google", "гугл", "bigquery", "pubsub", "pub/sub", "gke", "cloud run", "dataflow", "firestore"),
+    "k8s": ("k8s", "kubernetes", "кубер", "pod", "helm", "ingress", "statefulset"),
+    "openstack": ("openstack", "опенстек", "nova", "neutron", "keystone"),
+    "oci": ("oci", "oracle", "оракл"),
+    "alibabacloud": ("alibaba", "алибаба", "aliyun"),
+    "firebase": ("firebase", "файрбейс"),
+    "elastic": ("elastic", "эластик", "kibana", "кибана", "logstash", "beats"),
+    "saas": ("saas", "slack", "слак", "auth0", "okta", "cloudflare", "datadog", "newrelic", "pagerduty",
+             "telegram", "телеграм", "twilio", "stripe", "teams"),
+    "programming": ("python", "питон", "java", "джава", "golang", "go", "node", "react", "реакт", "vue",
+                    "angular", "django", "flask", "spring", "rails", "laravel", "flutter", "фреймворк",
+                    "framework", "язык"),
+}
+# Разделы для запросов без явного облака: on-prem и общие узлы
+DEFAULT_SECTIONS = ("onprem", "generic")
+
+
+def _keyword_pattern(keyword: str) -> str:
+    """Ключевое слово целым словом: латиница — с окончанием множественного числа (pods),
+    русские основы — с любым окончанием (лямбда, лямбды)"""
+    if re.search(r'[а-яё]', keyword):
+        return rf'(?<!\w){re.escape(keyword)}\w*'
+    return rf'(?<!\w){re.escape(keyword)}(?:s|es)?(?!\w)'
+
+
+# Совпадения по подстроке дают ложные срабатывания (rds в records, pod в podcast)
+SECTION_PATTERNS = {
+    name: re.compile("|".join(_keyword_pattern(keyword) for keyword in keywords))
+    for name, keywords in SECTION_KEYWORDS.items()
+}
+
+
+class PromptBuilder:
+    """Собирает компактный системный промпт из полного GIGACHAT_SYSTEM_PROMPT.
+
+    Полный промпт разбирается на вступление, разделы каталога узлов (# aws,
+    # azure, ...), примеры и правила. В компактный промпт попадают только
+    разделы, упомянутые в запросе (плюс on-prem и generic), и примеры, которые
+    используют только эти разделы, — в пределах max_chars символов.
+    Порядок частей всегда одинаковый, поэтому одинаковый выбор разделов дает
+    байт-в-байт одинаковый промпт, и провайдер может кэшировать его.
+    """
+
+    def __init__(self, full_prompt: str = GIGACHAT_SYSTEM_PROMPT, max_chars: int = PROMPT_MAX_CHARS,
+                 mode: str = PROMPT_MODE):
+        self.full_prompt = full_prompt
+        self.max_chars = max_chars
+        self.mode = mode
+        catalog_start = full_prompt.index(CATALOG_MARKER)
+        examples_start = full_prompt.index(EXAMPLES_MARKER)
+        rules_start = full_prompt.index(RULES_MARKER)
+        self.preamble = full_prompt[:catalog_start]
+        catalog = full_prompt[catalog_start:examples_start]
+        self.catalog_header, _, catalog_body = catalog.partition('\n')
+        self.sections = self._parse_sections(catalog_body)
+        self._checked_sections = False
+        self.examples = self._parse_examples(full_prompt[examples_start + len(EXAMPLES_MARKER):rules_start])
+        self.rules = full_prompt[rules_start:]
+
+    @staticmethod
+    def _parse_sections(catalog_body: str) -> Dict[str, str]:
+        sections: Dict[str, List[str]] = {}
+        current = None
+        for line in catalog_body.splitlines():
+            heading = re.match(r'^# (\w+)\s*$', line)
+            if heading:
+                current = heading.group(1).lower()
+                sections[current] = [line]
+            elif current and line.startswith('from diagrams.'):
+                # Закомментированные разделы и служебные комментарии пропускаем
+                sections[current].append(line)
+        return {name: "\n".join(lines) for name, lines in sections.items() if len(lines) > 1}
+
+    @staticmethod
+    def _filter_catalog_line(line: str) -> str:
+        """Оставляет в строке импорта только классы, которые есть в установленной diagrams"""
+        match = re.match(r'^from (diagrams\.[\w.]+) import (.+)$', line)
+        if not match:
+            return line
+        module = match.group(1)
+        names = [name.strip() for name in match.group(2).split(',')]
+        existing = [name for name in names if node_index.has_class(module, name)]
+        return f"from {module} import {', '.join(existing)}" if existing else ""
+
+    def _check_sections(self):
+        """Один раз сверяет рукописный каталог с индексом узлов, чтобы не предлагать модели несуществующие классы"""
+        if self._checked_sections or not node_index.available:
+            # Индекс может появиться позже: тогда проверим при следующей сборке промпта
+            return
+        self._checked_sections = True
+        for name, section in list(self.sections.items()):
+            heading, *lines = section.split('\n')
+            lines = [line for line in map(self._filter_catalog_line, lines) if line]
+            if lines:
+                self.sections[name] = "\n".join([heading] + lines)
+            else:
+                del self.sections[name]
+        # Примеры с несуществующими классами только путают модель
+        self.examples = [
+            (example, namespaces) for example, namespaces in self.examples
+            if all(
+                self._filter_catalog_line(line) == line
+                for line in example.splitlines() if line.startswith('from diagrams.')
+            )
+        ]
+
+    @staticmethod
+    def _parse_examples(examples_text: str) -> List[Tuple[str, Set[str]]]:
+        examples = []
+        for chunk in re.split(r'\n(?=# [^\n]+:\n)', examples_text):
+            chunk = chunk.strip()
+            if not chunk.startswith('# '):
+                continue
+            namespaces = set(re.findall(r'from diagrams\.(\w+)', chunk))
+            examples.append((chunk, namespaces))
+        return examples
+
+    def select_sections(self, text: str) -> List[str]:
+        """Разделы каталога по ключевым словам текста; сначала найденные, потом разделы по умолчанию"""
+        lowered = text.lower()
+        matched = [
+            name for name, pattern in SECTION_PATTERNS.items()
+            if name in self.sections and pattern.search(lowered)
+        ]
+        # Пространства имён, уже использованные в тексте (например, в коде для fix_code)
+        for namespace in re.findall(r'diagrams\.(\w+)', text):
+            if namespace in self.sections and namespace not in matched:
+                matched.append(namespace)
+        defaults = [name for name in DEFAULT_SECTIONS if name in self.sections and name not in matched]
+        return matched + defaults
+
+    def build(self, text: str) -> str:
+        """Системный промпт для запроса (или кода с ошибкой) text"""
+        if self.mode == "full":
+            return self.full_prompt
+        self._check_sections()
+        size = len(self.preamble) + len(self.catalog_header) + len(self.rules) + len(EXAMPLES_MARKER)
+        selected: Set[str] = set()
+        for name in self.select_sections(text):
+            section_size = len(self.sections[name]) + 2
+            if selected and size + section_size > self.max_chars:
+                continue
+            selected.add(name)
+            size += section_size
+        examples = []
+        for example, namespaces in self.examples:
+            if namespaces <= selected and size + len(example) + 2 <= self.max_chars:
+                examples.append(example)
+                size += len(example) + 2
+        # Разделы — в порядке полного промпта, чтобы промпт был стабильным
+        catalog = [self.sections[name] for name in self.sections if name in selected]
+        parts = [self.preamble + self.catalog_header, "\n\n".join(catalog)]
+        if examples:
+            parts.append(EXAMPLES_MARKER + "\n\n" + "\n\n".join(examples))
+        parts.append(self.rules)
+        return "\n\n".join(parts)
+
+
+# Глобальный сборщик промпта GigaChat
+prompt_builder = PromptBuilder()
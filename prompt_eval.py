@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Сравнение качества компактного и полного системного промпта GigaChat.
+
+Для каждого запроса из набора генерирует код с обоими промптами и пробует
+отрендерить его с первой попытки (без fix_code). Печатает размер промпта,
+время генерации и долю успешных рендеров по каждому режиму.
+"""
+
+import asyncio
+import time
+
+from gigachat_client import GigaChatClient
+from diagram_generator import diagram_generator
+from prompt_builder import prompt_builder
+from http_session import http_sessions
+from render_pool import render_pool
+
+SAMPLE_REQUESTS = [
+    "Веб-архитектура с базой данных",
+    "Микросервисная архитектура",
+    "CI/CD пайплайн",
+    "Сетевая топология",
+    "Процесс разработки ПО",
+    "Бессерверное приложение на AWS с Lambda, API Gateway и DynamoDB",
+    "Кластер Kubernetes с ingress, сервисами и StatefulSet",
+    "Аналитика на GCP: Pub/Sub, Dataflow и BigQuery",
+]
+MODES = ("full", "compact")
+
+
+async def evaluate(client: GigaChatClient, mode: str) -> dict:
+    prompt_builder.mode = mode
+    stats = {"ok": 0, "total": 0, "prompt_chars": 0, "seconds": 0.0}
+    for request in SAMPLE_REQUESTS:
+        stats["total"] += 1
+        stats["prompt_chars"] += len(prompt_builder.build(request))
+        started = time.monotonic()
+        try:
+            code = await client.generate_diagram_code(request)
+        except Exception as e:
+            print(f"  [{mode}] ❌ {request}: ошибка LLM: {e}")
+            continue
+        stats["seconds"] += time.monotonic() - started
+        try:
+            await diagram_generator.generate_diagram(code, 0)
+            stats["ok"] += 1
+            print(f"  [{mode}] ✅ {request}")
+        except Exception as e:
+            first_line = str(e).strip().splitlines()[-1] if str(e).strip() else ""
+            print(f"  [{mode}] ❌ {request}: {first_line}")
+    return stats
+
+
+async def main():
+    print("🧪 Сравнение полного и компактного промпта GigaChat")
+    print("==================================================")
+    api_key = input("Введите ваш API ключ GigaChat: ").strip()
+    client = GigaChatClient()
+    client.set_credentials(api_key)
+    results = {}
+    try:
+        for mode in MODES:
+            print(f"\n▶️ Режим: {mode}")
+            results[mode] = await evaluate(client, mode)
+    finally:
+        await render_pool.close()
+        await http_sessions.close()
+
+    print("\n📋 Итоги:")
+    for mode, stats in results.items():
+        total = stats["total"] or 1
+        print(
+            f"{mode:>8}: успешных рендеров {stats['ok']}/{stats['total']}, "
+            f"средний промпт {stats['prompt_chars'] // total} символов, "
+            f"среднее время генерации {stats['seconds'] / total:.1f} с"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,8 +1,22 @@
-from base_llm_client import BaseLLMClient
-import aiohttp
-import json
+from base_llm_client import BaseLLMClient, ProgressCallback
+from typing import List, Optional
+from config import SPECULATIVE_TEMPERATURE
+from http_session import http_sessions
+
+PROXYAPI_CHAT_URL = "https://proxyapi.ru/v1/chat/completions"
+
+PROXYAPI_SYSTEM_PROMPT = "Ты — помощник, который пишет только рабочий Python-код для генерации диаграмм с помощью библиотеки diagrams. Не используй несуществующие классы и пространства имён. Возвращай только рабочий Python-код."
+
 
 class ProxyApiClient(BaseLLMClient):
+    provider = "proxyapi"
+    system_prompt = PROXYAPI_SYSTEM_PROMPT
+    default_models = [
+        {"id": "gpt-3.5-turbo", "description": "GPT-3.5 Turbo"},
+        {"id": "gpt-4o-mini", "description": "GPT-4o mini"},
+        {"id": "gpt-4o", "description": "GPT-4o"},
+    ]
+
     def __init__(self, api_key: str = None):
         self.api_key = api_key
         self.model = "gpt-3.5-turbo"  # Можно сделать настраиваемым
@@ -11,43 +25,104 @@ class ProxyApiClient(BaseLLMClient):
     def set_credentials(self, api_key: str):
         self.api_key = api_key
 
+    def get_credentials(self) -> str:
+        return self.api_key
+
+    def set_model(self, model_id: str):
+        self.model = model_id
+
+    def get_current_model(self) -> str:
+        return self.model
+
     def get_last_error_details(self):
         return self.last_error_details
 
-    async def generate_diagram_code(self, user_request: str) -> str:
-        url = "https://proxyapi.ru/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def _generate_payload(self, user_request: str, stream: bool = False) -> dict:
         payload = {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": "Ты — помощник, который пишет только рабочий Python-код для генерации диаграмм с помощью библиотеки diagrams. Не используй несуществующие классы и пространства имён. Возвращай только рабочий Python-код."},
+                {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": f"Создай диаграмму: {user_request}"}
             ],
             "max_tokens": 2048,
             "temperature": 0.1
         }
-        async with aiohttp.ClientSession() as session:
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    async def generate_diagram_code(self, user_request: str) -> str:
+        url = PROXYAPI_CHAT_URL
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = self._generate_payload(user_request)
+        async with http_sessions.session("proxyapi") as session:
             async with session.post(url, headers=headers, json=payload, ssl=False) as response:
                 result = await response.json()
-                content = result["choices"][0]["message"]["content"]
+                choices = result.get("choices") or []
+                content = (choices[0].get("message") or {}).get("content") if choices else None
+                if not content:
+                    raise Exception("Пустой ответ от API")
                 # Извлекаем код из markdown блока
-                if '```python' in content:
-                    code_start = content.find('```python') + 9
-                    code_end = content.find('```', code_start)
-                    if code_end != -1:
-                        return content[code_start:code_end].strip()
-                elif '```' in content:
-                    code_start = content.find('```') + 3
-                    code_end = content.find('```', code_start)
-                    if code_end != -1:
-                        return content[code_start:code_end].strip()
-                return content.strip()
+                return self._extract_code(content)
+
+    async def generate_diagram_code_stream(self, user_request: str,
+                                           on_progress: Optional[ProgressCallback] = None) -> str:
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        }
+        payload = self._generate_payload(user_request, stream=True)
+        self.last_error_details = None
+        async with http_sessions.session("proxyapi") as session:
+            async with session.post(PROXYAPI_CHAT_URL, headers=headers, json=payload, ssl=False) as response:
+                if response.status != 200:
+                    response_text = await response.text()
+                    self.last_error_details = {
+                        'operation': 'generate_diagram_code_stream',
+                        'url': PROXYAPI_CHAT_URL,
+                        'method': 'POST',
+                        'response_status': response.status,
+                        'response_text': response_text[:1000],
+                        'error': f"Ошибка API: {response.status}"
+                    }
+                    raise Exception(f"Ошибка API: {response.status}")
+                content = await self._read_stream(response, on_progress)
+                if not content.strip():
+                    # Поток закончился без текста (например, только служебные события)
+                    self.last_error_details = {
+                        'operation': 'generate_diagram_code_stream',
+                        'url': PROXYAPI_CHAT_URL,
+                        'method': 'POST',
+                        'response_status': response.status,
+                        'error': "Пустой ответ от API"
+                    }
+                    raise Exception("Пустой ответ от API")
+                return self._extract_code(content)
+
+    async def generate_diagram_candidates(self, user_request: str, count: int) -> List[str]:
+        if count <= 1:
+            return [await self.generate_diagram_code(user_request)]
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = self._generate_payload(user_request)
+        payload["n"] = count
+        payload["temperature"] = SPECULATIVE_TEMPERATURE
+        async with http_sessions.session("proxyapi") as session:
+            async with session.post(PROXYAPI_CHAT_URL, headers=headers, json=payload, ssl=False) as response:
+                result = await response.json()
+                candidates = self._unique_candidates(result)
+                if not candidates:
+                    raise Exception("Пустой ответ от API")
+                return candidates
 
     async def fix_code(self, code_with_error: str, error_message: str) -> str:
-        url = "https://proxyapi.ru/v1/chat/completions"
+        url = PROXYAPI_CHAT_URL
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
@@ -55,7 +130,7 @@ class ProxyApiClient(BaseLLMClient):
         payload = {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": "Ты — помощник, который пишет только рабочий Python-код для генерации диаграмм с помощью библиотеки diagrams. Не используй несуществующие классы и пространства имён. Возвращай только рабочий Python-код."},
+                {"role": "system", "content": self.system_prompt},
                 {"role": "user", "content": (
                     "Внимание! Вот неработающий скрипт для генерации диаграммы. "
                     "Вот текст ошибки при выполнении: " + error_message + "\n"
@@ -67,18 +142,8 @@ class ProxyApiClient(BaseLLMClient):
             "max_tokens": 2048,
             "temperature": 0.1
         }
-        async with aiohttp.ClientSession() as session:
+        async with http_sessions.session("proxyapi") as session:
             async with session.post(url, headers=headers, json=payload, ssl=False) as response:
                 result = await response.json()
                 content = result["choices"][0]["message"]["content"]
-                if '```python' in content:
-                    code_start = content.find('```python') + 9
-                    code_end = content.find('```', code_start)
-                    if code_end != -1:
-                        return content[code_start:code_end].strip()
-                elif '```' in content:
-                    code_start = content.find('```') + 3
-                    code_end = content.find('```', code_start)
-                    if code_end != -1:
-                        return content[code_start:code_end].strip()
-                return content.strip() 
\ No newline at end of file
+                return self._extract_code(content) 
\ No newline at end of file
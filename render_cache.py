@@ -0,0 +1,148 @@
+import ast
+import hashlib
+import io
+import os
+import time
+import tokenize
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from config import DIAGRAMS_DIR, IMAGE_EXTENSIONS, RENDER_CACHE_MAX_BYTES, RENDER_CACHE_MAX_AGE, RENDER_CACHE_PIN_TIME
+
+
+def normalize_code(code: str) -> str:
+    """Приводит код к виду, не зависящему от пробелов, пустых строк и комментариев"""
+    try:
+        # Дерево разбора не содержит ни комментариев, ни форматирования
+        return ast.dump(ast.parse(code))
+    except (SyntaxError, ValueError):
+        pass
+    # Код не разбирается — убираем хотя бы комментарии и лишние пробелы
+    try:
+        tokens = [
+            token.string for token in tokenize.generate_tokens(io.StringIO(code).readline)
+            if token.type not in (tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE,
+                                  tokenize.INDENT, tokenize.DEDENT, tokenize.ENDMARKER)
+        ]
+        return " ".join(tokens)
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return "\n".join(line.strip() for line in code.splitlines() if line.strip())
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(normalize_code(code).encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Кэш готовых изображений по хэшу нормализованного кода диаграммы.
+
+    Файлы лежат в DIAGRAMS_DIR/cache, вытесняются по LRU при превышении
+    max_bytes и удаляются старше max_age секунд с последнего использования.
+    Путь, выданный get() или put(), pin_time секунд не вытесняется: за это
+    время бот успевает отправить файл, даже если кэш временно больше max_bytes.
+    """
+
+    def __init__(self, cache_dir: Path = Path(DIAGRAMS_DIR) / "cache",
+                 max_bytes: int = RENDER_CACHE_MAX_BYTES, max_age: float = RENDER_CACHE_MAX_AGE,
+                 pin_time: float = RENDER_CACHE_PIN_TIME):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.pin_time = pin_time
+        # hash -> (путь, размер, время последнего использования); порядок — от давно использованных к недавним
+        self._entries: Optional["OrderedDict[str, Tuple[Path, int, float]]"] = None
+        self._total_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _load(self):
+        """Восстанавливает индекс по файлам на диске (один раз, при первом обращении)"""
+        if self._entries is not None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        files = [
+            path for path in self.cache_dir.iterdir()
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+        ]
+        files.sort(key=lambda path: path.stat().st_mtime)
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        for path in files:
+            stat = path.stat()
+            self._entries[path.stem] = (path, stat.st_size, stat.st_mtime)
+            self._total_bytes += stat.st_size
+        self._evict()
+
+    def _forget(self, key: str) -> Path:
+        path, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        return path
+
+    @staticmethod
+    def _unlink(path: Path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _drop(self, key: str):
+        self._unlink(self._forget(key))
+
+    def _evict(self):
+        deadline = time.time() - self.max_age
+        for key, (path, _, used_at) in list(self._entries.items()):
+            if used_at >= deadline and path.exists():
+                # Дальше только более свежие записи
+                break
+            self._drop(key)
+        # Недавно выданные пути не трогаем: эти файлы, возможно, еще отправляются
+        pinned_since = time.time() - self.pin_time
+        for key, (_, _, used_at) in list(self._entries.items()):
+            if self._total_bytes <= self.max_bytes or used_at >= pinned_since:
+                break
+            self._drop(key)
+
+    def get(self, code: str) -> Optional[Path]:
+        """Возвращает путь к закэшированному изображению или None"""
+        if not self.enabled:
+            return None
+        self._load()
+        key = code_hash(code)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        path, size, used_at = entry
+        now = time.time()
+        if not path.exists() or used_at < now - self.max_age:
+            self._drop(key)
+            return None
+        # Время модификации служит отметкой последнего использования и после перезапуска
+        os.utime(path)
+        self._entries[key] = (path, size, now)
+        self._entries.move_to_end(key)
+        return path
+
+    def put(self, code: str, image_bytes: bytes, suffix: str) -> Path:
+        """Сохраняет изображение в кэш и возвращает путь к нему"""
+        self._load()
+        key = code_hash(code)
+        path = self.cache_dir / f"{key}{suffix}"
+        if key in self._entries:
+            old_path = self._forget(key)
+            # Файл с тем же путем заменит os.replace, удалять его заранее нельзя: его могут отправлять
+            if old_path != path:
+                self._unlink(old_path)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(image_bytes)
+        os.replace(tmp_path, path)
+        self._entries[key] = (path, len(image_bytes), time.time())
+        self._total_bytes += len(image_bytes)
+        self._evict()
+        return path
+
+
+# Глобальный кэш изображений
+render_cache = RenderCache()
@@ -0,0 +1,85 @@
+import ast
+import math
+import os
+from typing import Dict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from config import (
+    MAX_DIAGRAM_SIZE, RENDER_TIMEOUT_BASE, RENDER_TIMEOUT_PER_NODE, RENDER_TIMEOUT_PER_EDGE, RENDER_TIMEOUT_MAX,
+    RENDER_MEMORY_LIMIT, RENDER_MAX_OPEN_FILES, RENDER_ENV_VARS,
+)
+
+# Вызовы из diagrams, которые не являются узлами графа
+NON_NODE_CLASSES = {"Diagram", "Cluster", "Edge"}
+EDGE_OPERATORS = (ast.RShift, ast.LShift, ast.Sub)
+
+
+def count_graph_size(code: str):
+    """Оценивает число узлов и связей диаграммы по коду (без выполнения).
+
+    Узлы — вызовы классов, импортированных из diagrams.*, связи — операторы
+    >>, << и -. Узлы, созданные в цикле, считаются один раз, поэтому оценка
+    снизу; для подбора таймаута этого достаточно.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return 0, 0
+    node_classes = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and (node.module or "").startswith("diagrams"):
+            node_classes.update(alias.asname or alias.name for alias in node.names)
+    node_classes -= NON_NODE_CLASSES
+    nodes = edges = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in node_classes:
+            nodes += 1
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, EDGE_OPERATORS):
+            # a >> [b, c] — две связи
+            right = node.right
+            edges += len(right.elts) if isinstance(right, (ast.List, ast.Tuple)) else 1
+    return nodes, edges
+
+
+def render_timeout(code: str) -> float:
+    """Таймаут рендера, растущий с размером графа: больше узлов и связей — дольше работает Graphviz"""
+    nodes, edges = count_graph_size(code)
+    timeout = RENDER_TIMEOUT_BASE + nodes * RENDER_TIMEOUT_PER_NODE + edges * RENDER_TIMEOUT_PER_EDGE
+    return min(timeout, RENDER_TIMEOUT_MAX)
+
+
+def apply_render_limits(timeout: float):
+    """Ограничивает ресурсы текущего процесса (вызывается в процессе рендера до запуска кода).
+
+    Ограничения наследуются дочерними процессами, в том числе dot из Graphviz.
+    """
+    if resource is None:
+        return
+    cpu_seconds = int(math.ceil(timeout)) + 1
+    limits = [
+        (resource.RLIMIT_CPU, cpu_seconds),
+        (resource.RLIMIT_NOFILE, RENDER_MAX_OPEN_FILES),
+        # Ни один файл (изображение, .dot, лог) не больше несжатой картинки MAX_DIAGRAM_SIZE x MAX_DIAGRAM_SIZE (RGBA)
+        (resource.RLIMIT_FSIZE, MAX_DIAGRAM_SIZE * MAX_DIAGRAM_SIZE * 4),
+    ]
+    if RENDER_MEMORY_LIMIT:
+        limits.append((resource.RLIMIT_AS, RENDER_MEMORY_LIMIT))
+    for limit, value in limits:
+        soft, hard = resource.getrlimit(limit)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        try:
+            resource.setrlimit(limit, (value, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def render_environment(**overrides: str) -> Dict[str, str]:
+    """Окружение для процесса рендера: только RENDER_ENV_VARS, без токенов и ключей из .env"""
+    env = {name: os.environ[name] for name in RENDER_ENV_VARS if name in os.environ}
+    env.update(overrides)
+    return env
@@ -0,0 +1,196 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import signal
+import struct
+import sys
+from pathlib import Path
+from typing import Optional, Set, Tuple
+
+from config import RENDER_POOL_SIZE, RENDER_WORKER_MAX_JOBS, RENDER_WORKER_START_TIMEOUT
+from metrics import render_pool_workers, render_subprocesses_started
+from render_limits import render_environment
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).with_name("render_worker.py")
+
+
+class RenderWorkerError(Exception):
+    """Воркер не запустился или завершился посреди задания"""
+
+
+class RenderWorker:
+    """Один прогретый процесс render_worker.py"""
+
+    def __init__(self):
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.jobs_done = 0
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, str(WORKER_SCRIPT),
+            cwd=str(WORKER_SCRIPT.parent),
+            env=render_environment(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            # Своя группа процессов, чтобы при таймауте убить и форкнутый рендер
+            start_new_session=True
+        )
+        render_subprocesses_started.inc(kind="pool_worker")
+        try:
+            await asyncio.wait_for(self._read(), timeout=RENDER_WORKER_START_TIMEOUT)
+        except BaseException:
+            self.kill()
+            raise
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def _read(self) -> dict:
+        try:
+            header = await self.process.stdout.readexactly(4)
+            (length,) = struct.unpack('>I', header)
+            data = await self.process.stdout.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise RenderWorkerError("Воркер рендеринга завершился аварийно")
+        return json.loads(data.decode('utf-8'))
+
+    async def request(self, message: dict) -> dict:
+        data = json.dumps(message).encode('utf-8')
+        self.process.stdin.write(struct.pack('>I', len(data)) + data)
+        await self.process.stdin.drain()
+        return await self._read()
+
+    def kill(self):
+        if not self.alive:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class RenderPool:
+    """Пул прогретых воркеров рендеринга.
+
+    Воркер уже импортировал diagrams, поэтому рендер не платит за запуск
+    интерпретатора и импорт модулей. Воркер пересоздается после
+    RENDER_WORKER_MAX_JOBS заданий, после падения и после таймаута.
+    """
+
+    def __init__(self, size: int = RENDER_POOL_SIZE, max_jobs: int = RENDER_WORKER_MAX_JOBS):
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: Set[RenderWorker] = set()
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._failed = False
+
+    @property
+    def enabled(self) -> bool:
+        # Форк нужен воркеру для изоляции заданий, на Windows используем обычный subprocess
+        return self.size > 0 and hasattr(os, 'fork') and not self._failed
+
+    @property
+    def alive_workers(self) -> int:
+        return sum(worker.alive for worker in self._workers)
+
+    async def _spawn(self) -> RenderWorker:
+        worker = RenderWorker()
+        await worker.start()
+        self._workers.add(worker)
+        return worker
+
+    async def start(self):
+        """Запускает воркеры заранее. При ошибке пул отключается и рендер идет через subprocess"""
+        if self._idle is not None or not self.enabled:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._idle is not None:
+                return
+            try:
+                workers = [await self._spawn() for _ in range(self.size)]
+            except Exception as e:
+                logger.error(f"Не удалось запустить воркеры рендеринга, используется subprocess: {e}")
+                self._failed = True
+                await self.close()
+                return
+            idle = asyncio.Queue()
+            for worker in workers:
+                idle.put_nowait(worker)
+            self._idle = idle
+
+    async def _refill(self):
+        """Заменяет выбывший воркер новым; при ошибке оставляет пустой слот"""
+        try:
+            worker = await self._spawn()
+        except Exception as e:
+            logger.error(f"Не удалось перезапустить воркер рендеринга: {e}")
+            worker = None
+        if self._idle is None:
+            # Пул закрыли, пока запускался новый воркер
+            if worker is not None:
+                worker.kill()
+            return
+        self._idle.put_nowait(worker)
+
+    def _retire(self, worker: RenderWorker):
+        worker.kill()
+        self._workers.discard(worker)
+        asyncio.ensure_future(self._refill())
+
+    async def render(self, code: str, work_dir: Path, timeout: float) -> Tuple[Optional[bytes], Optional[str]]:
+        """Рендерит код в work_dir. Возвращает (байты изображения, расширение) или (None, None)
+
+        Ошибка выполнения скрипта поднимается как RuntimeError с текстом stderr,
+        превышение timeout — как asyncio.TimeoutError (воркер при этом убивается).
+        """
+        await self.start()
+        if self._idle is None:
+            raise RenderWorkerError("Пул воркеров рендеринга недоступен")
+        worker = await self._idle.get()
+        if worker is None or not worker.alive:
+            if worker is not None:
+                self._workers.discard(worker)
+            try:
+                worker = await self._spawn()
+            except BaseException:
+                self._idle.put_nowait(None)
+                raise
+        try:
+            response = await asyncio.wait_for(
+                worker.request({'code': code, 'work_dir': str(Path(work_dir).resolve()), 'timeout': timeout}),
+                timeout=timeout
+            )
+        except BaseException:
+            # Таймаут, падение воркера или отмена: состояние протокола неизвестно
+            self._retire(worker)
+            raise
+        worker.jobs_done += 1
+        if worker.jobs_done >= self.max_jobs:
+            self._retire(worker)
+        else:
+            self._idle.put_nowait(worker)
+
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error', ''))
+        if not response.get('image'):
+            return None, None
+        return base64.b64decode(response['image']), response.get('suffix', '.png')
+
+    async def close(self):
+        for worker in list(self._workers):
+            worker.kill()
+        self._workers.clear()
+        self._idle = None
+
+
+# Глобальный пул воркеров рендеринга
+render_pool = RenderPool()
+render_pool_workers.set_function(lambda: render_pool.alive_workers)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, List, Optional
+
+from config import RENDER_MAX_CONCURRENT, RENDER_MAX_QUEUE
+from metrics import queue_wait
+
+logger = logging.getLogger(__name__)
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class QueueFullError(Exception):
+    """Очередь генерации переполнена"""
+
+
+class _Ticket:
+    def __init__(self, user_id: int, on_position: Optional[PositionCallback]):
+        self.user_id = user_id
+        self.on_position = on_position
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.position: Optional[int] = None
+        # Последнее отправленное обновление позиции (его отменяем, когда оно устарело)
+        self.position_task: Optional[asyncio.Future] = None
+
+    def cancel_position_update(self):
+        if self.position_task is not None and not self.position_task.done():
+            self.position_task.cancel()
+
+
+class RenderScheduler:
+    """Ограничивает число одновременных генераций и честно делит очередь между пользователями.
+
+    Ожидающие задания лежат в отдельной очереди на каждого пользователя,
+    освободившийся слот отдается пользователям по кругу, поэтому один
+    пользователь с пачкой запросов не блокирует остальных.
+    """
+
+    def __init__(self, max_concurrent: int = RENDER_MAX_CONCURRENT, max_queue: int = RENDER_MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._active = 0
+        self._queues: "OrderedDict[int, Deque[_Ticket]]" = OrderedDict()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _order(self) -> List[_Ticket]:
+        """Порядок, в котором ожидающие получат слот: по кругу между пользователями"""
+        order = []
+        queues = [list(queue) for queue in self._queues.values()]
+        depth = 0
+        while True:
+            layer = [queue[depth] for queue in queues if len(queue) > depth]
+            if not layer:
+                return order
+            order.extend(layer)
+            depth += 1
+
+    def _notify_positions(self):
+        for position, ticket in enumerate(self._order(), start=1):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.on_position:
+                    # Новая позиция заменяет еще не показанную старую
+                    ticket.cancel_position_update()
+                    ticket.position_task = asyncio.ensure_future(self._call_position(ticket, position))
+
+    @staticmethod
+    async def _call_position(ticket: _Ticket, position: int):
+        if ticket.future.done():
+            # Слот уже выдан: позиция в очереди больше не актуальна
+            return
+        try:
+            await ticket.on_position(position)
+        except Exception as e:
+            logger.warning(f"Не удалось показать позицию в очереди: {e}")
+
+    def _dispatch(self):
+        while self._active < self.max_concurrent and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            # Пользователь уходит в конец круга
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            if ticket.future.done():
+                continue
+            self._active += 1
+            # Устаревшее "позиция N" не должно перезаписать статус уже начатой генерации
+            ticket.cancel_position_update()
+            ticket.future.set_result(None)
+        self._notify_positions()
+
+    def _remove(self, ticket: _Ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.user_id]
+
+    async def acquire(self, user_id: int, on_position: Optional[PositionCallback] = None) -> bool:
+        """Ждет свободный слот. Возвращает True, если пришлось постоять в очереди.
+
+        Если очередь заполнена, поднимает QueueFullError. on_position(position)
+        вызывается при каждом изменении позиции пользователя в очереди.
+        """
+        if self._active < self.max_concurrent and not self._queues:
+            self._active += 1
+            queue_wait.observe(0, queue="scheduler")
+            return False
+        if self.waiting >= self.max_queue:
+            raise QueueFullError("Очередь генерации переполнена")
+        ticket = _Ticket(user_id, on_position)
+        self._queues.setdefault(user_id, deque()).append(ticket)
+        self._notify_positions()
+        started = time.monotonic()
+        try:
+            await ticket.future
+            if ticket.position_task is not None:
+                # Дожидаемся отмены, чтобы следующее изменение статуса точно шло после нее
+                await asyncio.gather(ticket.position_task, return_exceptions=True)
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Слот уже выдан, но задание отменили — возвращаем его
+                self.release()
+            else:
+                self._remove(ticket)
+                ticket.cancel_position_update()
+                self._notify_positions()
+            raise
+        queue_wait.observe(time.monotonic() - started, queue="scheduler")
+        return True
+
+    def release(self):
+        """Освобождает слот и передает его следующему по очереди"""
+        self._active -= 1
+        self._dispatch()
+
+
+# Глобальный планировщик генераций
+render_scheduler = RenderScheduler()
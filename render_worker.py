@@ -0,0 +1,151 @@
+"""
+Прогретый воркер рендеринга диаграмм.
+
+Запускается пулом (render_pool.py) как отдельный процесс, один раз импортирует
+diagrams со всеми модулями узлов и дальше принимает задания через stdin.
+Каждое задание выполняется в форкнутом дочернем процессе, поэтому код
+пользователя не может испортить состояние воркера, а импорты уже прогреты.
+
+Протокол: сообщения в обе стороны — 4 байта длины (big-endian) + JSON.
+Запрос:  {"code": "...", "work_dir": "...", "timeout": 30}
+Ответ:   {"ok": true, "image": "<base64>", "suffix": ".png"}
+         {"ok": false, "error": "<stderr>"}
+"""
+
+import base64
+import json
+import os
+import struct
+import sys
+import traceback
+from pathlib import Path
+from typing import Optional
+
+from config import IMAGE_EXTENSIONS
+from render_limits import apply_render_limits, render_environment
+
+CODE_FILE_NAME = "diagram_code.py"
+STDERR_FILE_NAME = "stderr.log"
+
+
+def find_output_image(work_dir: Path) -> Optional[Path]:
+    """Ищет изображение, созданное скриптом в рабочей директории"""
+    images = [
+        path for path in work_dir.iterdir()
+        if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS
+    ]
+    if not images:
+        return None
+    # Если скрипт создал несколько диаграмм, берем последнюю
+    return max(images, key=lambda path: path.stat().st_mtime)
+
+
+def read_message(stream) -> Optional[dict]:
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    (length,) = struct.unpack('>I', header)
+    return json.loads(stream.read(length).decode('utf-8'))
+
+
+def write_message(stream, message: dict):
+    data = json.dumps(message).encode('utf-8')
+    stream.write(struct.pack('>I', len(data)) + data)
+    stream.flush()
+
+
+def preload():
+    """Импортирует diagrams и все модули узлов, чтобы дочерние процессы получили их готовыми"""
+    import importlib
+    import pkgutil
+    import diagrams
+
+    for module_info in pkgutil.walk_packages(diagrams.__path__, 'diagrams.'):
+        try:
+            importlib.import_module(module_info.name)
+        except Exception:
+            pass
+
+
+def _run_child(code: str, work_dir: Path, timeout: Optional[float], inherited_fds):
+    """Выполняется в форкнутом процессе: запускает скрипт так же, как `python diagram_code.py`"""
+    exit_code = 1
+    try:
+        # Каналы протокола дочернему процессу не нужны
+        for fd in inherited_fds:
+            os.close(fd)
+        devnull_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull_fd, 0)
+        os.chdir(work_dir)
+        log_fd = os.open(STDERR_FILE_NAME, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        if timeout:
+            # Лимиты ставим только рендеру: сам воркер живет долго
+            apply_render_limits(timeout)
+        # Воркер при импорте config снова прочитал .env: коду пользователя секреты не оставляем
+        env = render_environment()
+        os.environ.clear()
+        os.environ.update(env)
+        sys.argv = [CODE_FILE_NAME]
+        sys.path.insert(0, str(work_dir))
+        compiled = compile(code, CODE_FILE_NAME, 'exec')
+        exec(compiled, {'__name__': '__main__', '__file__': CODE_FILE_NAME})
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        # Кадр самого воркера в трассировке пользователю не нужен
+        exc_type, exc_value, exc_tb = sys.exc_info()
+        traceback.print_exception(exc_type, exc_value, exc_tb.tb_next)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def run_job(code: str, work_dir: Path, timeout: Optional[float] = None, inherited_fds=()) -> dict:
+    pid = os.fork()
+    if pid == 0:
+        _run_child(code, work_dir, timeout, inherited_fds)
+    _, status = os.waitpid(pid, 0)
+    exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if exit_code != 0:
+        stderr_file = work_dir / STDERR_FILE_NAME
+        error = stderr_file.read_text(encoding='utf-8', errors='ignore') if stderr_file.exists() else ""
+        return {'ok': False, 'error': error or f"Процесс завершился с кодом {exit_code}"}
+    image_file = find_output_image(work_dir)
+    if image_file is None:
+        return {'ok': True, 'image': None}
+    return {
+        'ok': True,
+        'image': base64.b64encode(image_file.read_bytes()).decode('ascii'),
+        'suffix': image_file.suffix.lower(),
+    }
+
+
+def main():
+    # Канал протокола — исходный stdout; обычный вывод уводим в stderr,
+    # чтобы случайный print не сломал обмен сообщениями
+    requests = sys.stdin.buffer
+    responses = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+
+    preload()
+    write_message(responses, {'ready': True})
+
+    while True:
+        request = read_message(requests)
+        if request is None:
+            break
+        try:
+            response = run_job(request['code'], Path(request['work_dir']), request.get('timeout'), (responses.fileno(),))
+        except Exception as e:
+            response = {'ok': False, 'error': f"Ошибка воркера рендеринга: {e}"}
+        write_message(responses, response)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import TELEGRAM_FILE_CACHE_FILE
+from metrics import count_cache
+
+
+def image_hash(path: str) -> str:
+    """Хэш содержимого изображения: одинаковые картинки получают один file_id"""
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+class TelegramFileCache:
+    """Запоминает file_id, который Telegram вернул для уже отправленного изображения.
+
+    Повторная отправка по file_id не загружает файл заново. Соответствия
+    хранятся в памяти и в SQLite, чтобы пережить перезапуск бота.
+    """
+
+    def __init__(self, path: str = TELEGRAM_FILE_CACHE_FILE):
+        self.path = path
+        self._file_ids: Optional[Dict[str, str]] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS telegram_files ("
+                " image_hash TEXT PRIMARY KEY,"
+                " file_id TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _load_sync(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._connect().execute("SELECT image_hash, file_id FROM telegram_files"))
+
+    def _write_sync(self, key: str, file_id: Optional[str]):
+        with self._lock:
+            conn = self._connect()
+            if file_id is None:
+                conn.execute("DELETE FROM telegram_files WHERE image_hash = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO telegram_files (image_hash, file_id) VALUES (?, ?)",
+                    (key, file_id)
+                )
+            conn.commit()
+
+    async def _ensure_loaded(self):
+        if self._file_ids is None:
+            self._file_ids = await asyncio.get_running_loop().run_in_executor(None, self._load_sync)
+
+    async def get(self, key: str) -> Optional[str]:
+        await self._ensure_loaded()
+        file_id = self._file_ids.get(key)
+        count_cache("telegram_file", file_id is not None)
+        return file_id
+
+    async def put(self, key: str, file_id: str):
+        await self._ensure_loaded()
+        self._file_ids[key] = file_id
+        await asyncio.get_running_loop().run_in_executor(None, self._write_sync, key, file_id)
+
+    async def invalidate(self, key: str):
+        """Забывает file_id, который Telegram больше не принимает"""
+        await self._ensure_loaded()
+        if self._file_ids.pop(key, None) is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_sync, key, None)
+
+
+# Глобальный кэш file_id отправленных диаграмм
+telegram_file_cache = TelegramFileCache()
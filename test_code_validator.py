@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Проверки валидатора кода диаграмм и статической проверки (нужен установленный diagrams):
+
+    python -m pytest test_code_validator.py
+"""
+
+from code_validator import CodeValidator
+from preflight import preflight_check
+
+VALID_CODE = '''from diagrams import Diagram, Cluster
+from diagrams.aws.compute import EC2
+import diagrams.aws.database
+
+with Diagram("Веб-сервис", show=False):
+    with Cluster("Бэкенд"):
+        EC2("api") >> diagrams.aws.database.RDS("db")
+'''
+
+# Обход белого списка через то, что импортировано внутри пакета diagrams
+ESCAPE_PAYLOADS = [
+    'import diagrams\ndiagrams.os.system("id")',
+    'from diagrams import os\nos.system("id")',
+    'from diagrams import Path\nPath("/tmp/pwn").write_text("x")',
+    'import diagrams.aws\ndiagrams.aws.os.system("id")',
+    'import diagrams as d\nx = d\nx.os.system("id")',
+    'from diagrams import *\nos.system("id")',
+    'def f():\n    return diagrams.os\nimport diagrams\nf().system("id")',
+]
+
+# Обход через объекты Python: строки формата, закрытые атрибуты, кадры, graphviz
+OBJECT_PAYLOADS = [
+    'from diagrams.aws.compute import EC2\nprint("{0.__init__.__globals__[os].environ[BOT_TOKEN]}".format(EC2))',
+    'from diagrams.aws.compute import EC2\nf = "{0.__init__.__globals__}".format_map\nprint(f)',
+    'from diagrams import Diagram\nwith Diagram("x", show=False) as d:\n    d.dot.save("/tmp/x")',
+    'from diagrams import Diagram\nwith Diagram("x", show=False) as d:\n    d.render()',
+    'from diagrams import Diagram\nfrom diagrams.aws.compute import EC2\nwith Diagram("x", show=False):\n    node = EC2("a")\n    print(node._diagram)',
+    'import diagrams\ng = (x for x in [1])\nprint(g.gi_frame.f_globals["__builtins__"])',
+    'from diagrams import Diagram\nwith Diagram("x", filename="/tmp/pwn", show=False):\n    pass',
+    'from diagrams import Diagram as D\nwith D("x", "../pwn", show=False):\n    pass',
+]
+
+
+def test_valid_code_passes():
+    assert CodeValidator().validate(VALID_CODE) == []
+    assert preflight_check(VALID_CODE) == []
+
+
+def test_escape_payloads_rejected():
+    validator = CodeValidator()
+    for code in ESCAPE_PAYLOADS:
+        assert validator.validate(code), code
+
+
+def test_object_payloads_rejected():
+    validator = CodeValidator()
+    for code in OBJECT_PAYLOADS:
+        assert validator.validate(code), code
+
+
+def test_render_environment_has_no_secrets(monkeypatch):
+    from render_limits import render_environment
+    monkeypatch.setenv("BOT_TOKEN", "123456:SECRET")
+    monkeypatch.setenv("PROXYAPI_KEY", "secret")
+    env = render_environment(PYTHONPATH="/tmp/work")
+    assert "BOT_TOKEN" not in env and "PROXYAPI_KEY" not in env
+    assert env["PYTHONPATH"] == "/tmp/work"
+
+
+def test_preflight_reports_module_attributes():
+    code = 'import diagrams\nwith diagrams.Diagram("x", show=False):\n    diagrams.os.system("id")'
+    assert any("diagrams.os" in problem for problem in preflight_check(code))
+
+
+def test_diagram_alias_passes_preflight():
+    code = 'from diagrams import Diagram as D\nwith D("x", show=False):\n    pass'
+    assert preflight_check(code) == []
+
+
+if __name__ == "__main__":
+    for test in (test_valid_code_passes, test_escape_payloads_rejected, test_object_payloads_rejected,
+                 test_preflight_reports_module_attributes, test_diagram_alias_passes_preflight):
+        test()
+        print(f"✅ {test.__name__}")
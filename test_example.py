@@ -5,9 +5,12 @@
 
 import asyncio
 import os
-from gigachat_client import gigachat_client
+from gigachat_client import GigaChatClient
 from diagram_generator import diagram_generator
 
+# Клиенты создаются на каждый запрос (см. llm_clients); для проверки хватит одного
+gigachat_client = GigaChatClient()
+
 
 async def test_gigachat_connection():
     """Тест подключения к GigaChat"""
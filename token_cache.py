@@ -0,0 +1,59 @@
+import asyncio
+import hashlib
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from config import TOKEN_REFRESH_MARGIN
+
+
+class TokenCache:
+    """Кэш OAuth-токенов, общий для всех запросов с одинаковыми учетными данными.
+
+    Ключ — хэш секрета, а не сам секрет. Токен считается устаревшим за
+    TOKEN_REFRESH_MARGIN секунд до истечения. Конкурентные запросы с одним
+    ключом ждут одного обновления вместо того, чтобы гоняться друг с другом.
+    """
+
+    def __init__(self, refresh_margin: float = TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _key(credential: str) -> str:
+        return hashlib.sha256(credential.encode('utf-8')).hexdigest()
+
+    def _fresh(self, key: str) -> Optional[str]:
+        entry = self._tokens.get(key)
+        if entry and time.time() < entry[1] - self.refresh_margin:
+            return entry[0]
+        return None
+
+    async def get_token(self, credential: str, fetch: Callable[[], Awaitable[Tuple[str, float]]]) -> str:
+        """Возвращает действующий токен, при необходимости вызывая fetch() -> (token, expires_at)"""
+        key = self._key(credential)
+        token = self._fresh(key)
+        if token:
+            return token
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            token = self._fresh(key)
+            if token:
+                return token
+            token, expires_at = await fetch()
+            self._tokens[key] = (token, expires_at)
+            return token
+
+    def get_expires_at(self, credential: str) -> float:
+        """Возвращает время истечения закэшированного токена (0, если его нет)"""
+        entry = self._tokens.get(self._key(credential))
+        return entry[1] if entry else 0
+
+    def invalidate(self, credential: str):
+        """Удаляет токен из кэша (например, после ответа 401)"""
+        self._tokens.pop(self._key(credential), None)
+
+
+# Глобальный кэш токенов
+token_cache = TokenCache()
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from config import USER_DB_FILE, USER_DATA_JSON_FILE, USER_SETTINGS_TTL
+
+logger = logging.getLogger(__name__)
+
+# Колонки таблицы users, которые можно менять через _set
+USER_FIELDS = ("api_key", "model", "llm_provider", "no_cache")
+
+
+class UserStore:
+    """Настройки пользователей в SQLite (режим WAL).
+
+    Каждое изменение — upsert одной строки, а не перезапись всего файла.
+    Все обращения к базе идут в отдельном потоке, чтобы не блокировать
+    цикл событий. При первом запуске импортирует старый user_data.json.
+    Прочитанные настройки процесс помнит ttl секунд: изменения из других
+    процессов с тем же файлом видны не позже, чем через ttl.
+    """
+
+    def __init__(self, path: str = USER_DB_FILE, json_path: str = USER_DATA_JSON_FILE,
+                 ttl: float = USER_SETTINGS_TTL):
+        self.path = path
+        self.json_path = json_path
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        # user_id -> (время чтения, настройки или None)
+        self._cache: Dict[int, Tuple[float, Optional[Dict[str, Any]]]] = {}
+        # Один поток: SQLite-соединение используется строго последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user_store")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " user_id INTEGER PRIMARY KEY,"
+                " api_key TEXT,"
+                " model TEXT,"
+                " llm_provider TEXT,"
+                " no_cache INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.commit()
+            self._conn = conn
+            self._migrate_json()
+        return self._conn
+
+    def _migrate_json(self):
+        """Переносит данные из user_data.json (если он есть) и переименовывает файл"""
+        if not os.path.exists(self.json_path):
+            return
+        try:
+            with open(self.json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать {self.json_path} для миграции: {e}")
+            return
+        rows: Dict[int, Dict[str, Any]] = {}
+        # В JSON ключи user_id сохранялись строками
+        for user_id, api_key in data.get("api_keys", {}).items():
+            rows.setdefault(int(user_id), {})["api_key"] = api_key
+        for user_id, model in data.get("models", {}).items():
+            rows.setdefault(int(user_id), {})["model"] = model
+        for user_id in data.get("no_cache", []):
+            rows.setdefault(int(user_id), {})["no_cache"] = 1
+        for user_id, fields in rows.items():
+            for field, value in fields.items():
+                self._upsert(user_id, field, value)
+        self._conn.commit()
+        os.replace(self.json_path, self.json_path + ".migrated")
+        logger.info(f"Перенесено пользователей из {self.json_path}: {len(rows)}")
+
+    def _upsert(self, user_id: int, field: str, value):
+        self._conn.execute(
+            f"INSERT INTO users (user_id, {field}) VALUES (?, ?) "
+            f"ON CONFLICT(user_id) DO UPDATE SET {field} = excluded.{field}",
+            (user_id, value)
+        )
+
+    def _set_sync(self, user_id: int, field: str, value):
+        self._connect()
+        self._upsert(user_id, field, value)
+        self._conn.commit()
+
+    def _get_sync(self, user_id: int):
+        row = self._connect().execute(
+            "SELECT api_key, model, llm_provider, no_cache FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"user_id": user_id, "api_key": row[0], "model": row[1], "llm_provider": row[2], "no_cache": bool(row[3])}
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Настройки одного пользователя (None, если их нет)"""
+        cached = self._cache.get(user_id)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            return dict(cached[1]) if cached[1] is not None else None
+        user = await self._run(self._get_sync, user_id)
+        now = time.monotonic()
+        # Заодно забываем устаревшие записи, чтобы кэш не рос со временем
+        self._cache = {key: entry for key, entry in self._cache.items() if now - entry[0] < self.ttl}
+        self._cache[user_id] = (now, user)
+        return dict(user) if user is not None else None
+
+    async def _set(self, user_id: int, field: str, value):
+        if field not in USER_FIELDS:
+            raise ValueError(f"Неизвестное поле пользователя: {field}")
+        await self._run(self._set_sync, user_id, field, value)
+        self._cache.pop(user_id, None)
+
+    async def set_api_key(self, user_id: int, api_key: str):
+        await self._set(user_id, "api_key", api_key)
+
+    async def set_model(self, user_id: int, model: Optional[str]):
+        await self._set(user_id, "model", model)
+
+    async def set_llm_provider(self, user_id: int, provider: str):
+        await self._set(user_id, "llm_provider", provider)
+
+    async def set_no_cache(self, user_id: int, no_cache: bool):
+        await self._set(user_id, "no_cache", int(no_cache))
+
+    def _close_sync(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        await self._run(self._close_sync)
+
+
+# Глобальное хранилище настроек пользователей
+user_store = UserStore()
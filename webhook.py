@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.types import TelegramObject
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_DRAIN_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class InFlightUpdates(BaseMiddleware):
+    """Считает обновления, которые сейчас обрабатываются (включая генерацию диаграмм)"""
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if self.count == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Ждет завершения всех обновлений; False, если не дождались за timeout секунд"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Принимает обновления через вебхук до SIGINT/SIGTERM.
+
+    При остановке сервер сначала перестает принимать новые запросы, затем
+    ждет (до WEBHOOK_DRAIN_TIMEOUT секунд), пока закончатся начатые генерации.
+    """
+    in_flight = InFlightUpdates()
+    dp.update.outer_middleware(in_flight)
+
+    app = web.Application()
+    # Запросы без правильного секретного заголовка отклоняются с 401
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Вебхук слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logger.info(f"Вебхук зарегистрирован в Telegram: {WEBHOOK_URL}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Остановка вебхука: новые обновления не принимаются")
+        await site.stop()
+        if in_flight.count:
+            logger.info(f"Ожидаю завершения обработки обновлений: {in_flight.count}")
+        if not await in_flight.wait_idle(WEBHOOK_DRAIN_TIMEOUT):
+            logger.warning(f"Не дождались завершения {in_flight.count} обновлений за {WEBHOOK_DRAIN_TIMEOUT} с")
+        await runner.cleanup()